@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+
+def pool_dir():
+    """
+    Returns the cache pool path, where workspaces and caches are kept
+    """
+    cache_dir = os.environ.get('XDG_CACHE_HOME',
+                               os.path.join(os.environ.get('HOME'), '.cache'))
+    return os.path.join(cache_dir, 'mx')
+
+
+class Cache(object):
+    """
+    JSON document persisted in the cache pool
+    """
+    def __init__(self, name):
+        """
+        :param name: File name within the cache pool
+        """
+        self._path = os.path.join(pool_dir(), name)
+        self._changed = False
+        try:
+            with open(self._path, 'r') as f:
+                self._data = json.load(f)
+        except (IOError, OSError, ValueError):
+            self._data = {}
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def set(self, key, value):
+        self._data[key] = value
+        self._changed = True
+
+    def update(self, values):
+        self._data.update(values)
+        self._changed = True
+
+    def save(self):
+        """
+        Atomically write the document, if anything changed
+        """
+        if not self._changed:
+            return
+        directory = os.path.dirname(self._path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_path = '{}.{}.tmp'.format(self._path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(self._data, f)
+        os.replace(tmp_path, self._path)
+        self._changed = False
+
+
+class StatusCache(Cache):
+    """
+    Repositories' branch, upstream and last commit, keyed by path and
+    validated by the fingerprint of their git metadata files
+
+    Work-tree changes don't alter the fingerprint, so modified and
+    untracked counts aren't cached.
+    """
+    def __init__(self, workspace_name):
+        super(StatusCache, self).__init__(
+            '{}.status.json'.format(workspace_name))
+
+    def lookup(self, path, fingerprint):
+        """
+        Returns the cached refs if fingerprint is unchanged, or None
+        """
+        entry = self.get(path)
+        if fingerprint and entry and entry['fingerprint'] == fingerprint:
+            return entry.get('refs')
+        return None
+
+    def store(self, path, fingerprint, refs):
+        if fingerprint:
+            self.set(path, {'fingerprint': fingerprint, 'refs': refs})
+
+
+class TaskCache(Cache):
+    """
+    Workspace commands' input fingerprints at their last successful run
+    """
+    def __init__(self, workspace_name):
+        super(TaskCache, self).__init__(
+            '{}.tasks.json'.format(workspace_name))
+
+    def is_current(self, name, fingerprint):
+        """
+        Returns true if the command last succeeded with the same inputs
+        """
+        return bool(fingerprint) and self.get(name) == fingerprint
+
+    def store(self, name, fingerprint):
+        if fingerprint:
+            self.set(name, fingerprint)
+        elif self.get(name) is not None:
+            self.set(name, None)
+
+
+class SummaryCache(Cache):
+    """
+    Workspace's precomputed summary for prompts and status lines: session
+    state, dirty repositories, ahead/behind totals and the last fetch
+    """
+    def __init__(self, workspace_name):
+        super(SummaryCache, self).__init__(
+            '{}.summary.json'.format(workspace_name))
+        self._name = workspace_name
+
+    def render(self):
+        """
+        Returns the summary as a compact line, e.g. `funyard● 3* ↑2 ↓5 !1`
+        """
+        if not self._data:
+            return ''
+        state = u'\u25cf' if self.get('session') else u'\u25cb'
+        parts = [self._name + state]
+        for key, template in (('dirty', u'{}*'), ('ahead', u'\u2191{}'),
+                              ('behind', u'\u2193{}'),
+                              ('fetch_failed', u'!{}')):
+            if self.get(key):
+                parts.append(template.format(self.get(key)))
+        return u' '.join(parts)
+
+
+class ConfigCache(Cache):
+    """
+    Parsed snapshot of a workspace yml file, validated by the file's
+    modification time and size
+    """
+    def __init__(self, cfg_path):
+        """
+        :param cfg_path: Real path of a workspace yml file
+        """
+        stat = os.stat(cfg_path)
+        self._stat = [stat.st_mtime_ns, stat.st_size]
+        super(ConfigCache, self).__init__(os.path.join(
+            'configs', '{}.json'.format(cfg_path.replace(os.sep, '%'))))
+
+    def lookup(self):
+        """
+        Returns the parsed config if the file is unchanged, or None
+        """
+        if self.get('stat') == self._stat:
+            return self.get('config')
+        return None
+
+    def store(self, config):
+        # Only cache what JSON preserves, e.g. not dates or numeric keys
+        try:
+            if json.loads(json.dumps(config)) != config:
+                return
+        except (TypeError, ValueError):
+            return
+        self.set('stat', self._stat)
+        self.set('config', config)
@@ -1,55 +1,139 @@
 # -*- coding: utf-8 -*-
-import yaml
-import argparse
 import os
 import sys
+from contextlib import contextmanager
 from . import __version__
-from .logger import Logger
-from .git import Git
-from .tmux import TmuxException
-from .workspace import Workspace, WorkspaceException
+from .cache import ConfigCache, SummaryCache, pool_dir
 
-WORKSPACE_COMMANDS = ['attach', 'start', 'stop', 'ls', 'init']
+# Actions' modules are imported on demand, to keep startup fast
+
+WORKSPACE_COMMANDS = ['attach', 'start', 'stop', 'ls', 'init', 'freeze']
 GIT_COMMANDS = ['clone', 'fetch', 'status']
+MULTI_COMMANDS = ['fetch', 'status', 'start', 'stop']
+STRUCTURED_COMMANDS = ['status', 'fetch', 'clone', 'ls']
+PROMPT = ['prompt']
+
+# Exceptions reported by handle_errors(), by module
+ERRORS = [(__package__ + '.workspace', 'WorkspaceException'),
+          (__package__ + '.tmux', 'TmuxException'),
+          (__package__ + '.git', 'GitException')]
 
 
 def main():
     """
     Start main program: Parse user arguments and take action
     """
+    # Status lines run `prompt` every few seconds, skip everything else
+    if sys.argv[1:2] == PROMPT:
+        prompt(*sys.argv[2:3])
+        return
+
+    import argparse
+    from .logger import Logger
+
     parser = argparse.ArgumentParser(
         description='mx: Orchestrate tmux sessions and git projects')
 
     parser.add_argument('action', type=str, nargs='?', default='start',
-                        choices=WORKSPACE_COMMANDS + GIT_COMMANDS,
-                        help='an action for %(prog)s (default: %(default)s)')
-    parser.add_argument('session', type=str, nargs='?',
-                        help='session for %(prog)s to load'
-                        ' (default: current directory\'s .mx.yml)')
+                        choices=WORKSPACE_COMMANDS + GIT_COMMANDS + PROMPT,
+                        help='an action for %(prog)s (default: start)')
+    parser.add_argument('session', type=str, nargs='*',
+                        help='session for %(prog)s to load, or several'
+                        ' sessions and glob patterns for {}'
+                        ' (default: current directory\'s .mx.yml)'
+                        .format('/'.join(MULTI_COMMANDS)))
     parser.add_argument('-c', '--config', type=str, default='.mx.yml',
                         help='workspace yml config file'
                              ' (default: %(default)s)')
+    parser.add_argument('-a', '--all', action='store_true',
+                        help='run {} on all sessions in the cache pool'
+                        .format('/'.join(MULTI_COMMANDS)))
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of concurrent git operations'
+                             ' (default: config\'s `jobs` or 8)')
+    parser.add_argument('-r', '--refresh', action='store_true',
+                        help='ignore cached status of unchanged repositories')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='keep refreshing status as repositories change')
+    parser.add_argument('-s', '--stale', type=float, metavar='MINUTES',
+                        help='fetch only repositories not fetched within'
+                             ' the last MINUTES')
+    parser.add_argument('-b', '--budget', type=duration,
+                        help='stop starting new fetches after a duration,'
+                             ' e.g. 30s, 5m or 1h')
+    parser.add_argument('-d', '--depth', type=int, default=2,
+                        help='levels of sub-directories `init` searches for'
+                             ' repositories (default: %(default)s)')
+    parser.add_argument('-f', '--format', default='text',
+                        choices=['text', 'json', 'ndjson'],
+                        help='output records of {} for machines'
+                             ' (default: %(default)s)'
+                        .format('/'.join(STRUCTURED_COMMANDS)))
+    parser.add_argument('-p', '--profile', action='store_true',
+                        help='print the slowest git and tmux commands, and'
+                             ' save a Chrome trace to $MX_TRACE'
+                             ' (default: ~/.cache/mx/trace.json)')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='print the tmux commands `start` would run')
     parser.add_argument('-v', action='version',
                         version='%(prog)s {}'.format(__version__))
 
-    args = parser.parse_args()
+    # Options may come between sessions, e.g. `mx start a -n b`
+    args = getattr(parser, 'parse_intermixed_args', parser.parse_args)()
+    sessions = args.session
+    args.session = sessions[0] if len(sessions) == 1 else None
+    if args.action in PROMPT:
+        prompt(args.session)
+        return
+    log = Logger()
+    trace_path = os.environ.get('MX_TRACE')
+    if args.profile or trace_path:
+        import atexit
+        from . import trace
+        trace.enable()
+        atexit.register(trace.finish, trace_path or os.path.join(
+            pool_dir(), 'trace.json'))
+    if args.action in STRUCTURED_COMMANDS and args.format != 'text':
+        # Finish json output however the action exits
+        import atexit
+        Logger.set_format(args.format)
+        atexit.register(log.close)
+
+    options = {}
+    if args.action == 'status':
+        options['refresh'] = args.refresh
+        options['watch'] = args.watch
+    elif args.action == 'fetch':
+        options['stale'] = args.stale
+        options['budget'] = args.budget
+    elif args.action == 'start':
+        options['dry_run'] = args.dry_run
 
-    # Compute cache pool path
-    cache_dir = os.environ.get('XDG_CACHE_HOME',
-                               os.path.join(os.environ.get('HOME'), '.cache'))
-    pool_dir = os.path.join(cache_dir, 'mx')
+    patterns = ['*'] if args.all else sessions
+    if len(patterns) > 1 or any(c in p for p in patterns for c in '*?['):
+        if args.action not in MULTI_COMMANDS:
+            log.echo('[red]ERROR: [reset]Multiple sessions are only'
+                     ' supported by {}'.format(', '.join(MULTI_COMMANDS)))
+            log.record('error', message='Multiple sessions are only'
+                       ' supported by {}'.format(', '.join(MULTI_COMMANDS)))
+            sys.exit(2)
+        with handle_errors(log):
+            run_many(patterns, args.action, args.jobs, **options)
+        return
 
     if args.session:
         # Load session from cache pool (symlinks)
-        cfg_path = os.path.join(pool_dir, '{}.yml'.format(args.session))
+        cfg_path = os.path.join(pool_dir(), '{}.yml'.format(args.session))
     else:
         # Load session from cli option (or default value)
         cfg_path = os.path.realpath(args.config)
 
-    log = Logger()
     if not os.path.isfile(cfg_path):
         if args.action == 'init':
-            schema = Workspace.initialize(os.getcwd())
+            import yaml
+            from .workspace import Workspace
+            schema = Workspace.initialize(os.getcwd(), args.depth,
+                                          args.jobs)
             with open(cfg_path, 'w') as cfg_file:
                 cfg_file.write(
                     yaml.safe_dump(schema, default_flow_style=False))
@@ -57,24 +141,70 @@ def main():
         else:
             log.echo('[red]ERROR: [reset]Unable to find [white]{}'
                      .format(cfg_path))
+            log.record('error', message='Unable to find', errors=cfg_path)
             sys.exit(2)
 
-    try:
+    with handle_errors(log):
         # Read configuration and run the requested action
-        with open(cfg_path, 'r') as stream:
-            config = yaml.load(stream)
-        run(config, args.action)
+        config = load_config(cfg_path)
+        if args.jobs:
+            config['jobs'] = args.jobs
+        run(config, args.action, **options)
 
         # Save session symlink in cache pool
-        if not os.path.isdir(pool_dir):
-            os.makedirs(pool_dir)
-        link = os.path.join(pool_dir, '{}.yml'.format(config.get('name')))
+        if not os.path.isdir(pool_dir()):
+            os.makedirs(pool_dir())
+        link = os.path.join(pool_dir(), '{}.yml'.format(config.get('name')))
         if not os.path.islink(link):
             os.symlink(cfg_path, link)
 
-    except (WorkspaceException, TmuxException) as e:
+
+def duration(value):
+    """
+    Parse a duration argument in seconds, minutes or hours, e.g. 30s, 5m,
+    1h or 90 (seconds)
+    """
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    value = value.strip().lower()
+    if value[-1:] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def prompt(session=None):
+    """
+    Print a workspace's compact summary for shell prompts and tmux status
+    lines, from what `status`, `fetch`, `start` and `stop` last saved
+
+    :param session: Session name (default: current directory's .mx.yml)
+    """
+    if not session:
+        try:
+            config = ConfigCache(os.path.realpath('.mx.yml')).lookup()
+        except OSError:
+            config = None
+        session = (config or {}).get('name')
+    if session:
+        sys.stdout.write(SummaryCache(session).render() + '\n')
+
+
+@contextmanager
+def handle_errors(log):
+    """
+    Report workspace, tmux and git errors and exit
+    """
+    try:
+        yield
+    except Exception as e:
+        # Only modules already imported by the action could have raised
+        errors = tuple(getattr(sys.modules[module], name)
+                       for module, name in ERRORS if module in sys.modules)
+        if not isinstance(e, errors):
+            raise
         if hasattr(e, '__context__') and e.__context__:
             log.echo(' -> {}'.format(e.__context__))
+        log.record('error', message=getattr(e, 'message', str(e)),
+                   errors=getattr(e, 'errors', ''))
         if hasattr(e, 'errors'):
             log.echo('[red]{}: [reset]{}'.format(e.message, e.errors))
         else:
@@ -82,15 +212,71 @@ def main():
         sys.exit(3)
 
 
-def run(config, action):
+def load_config(cfg_path):
+    """
+    Read a workspace yml configuration file, or its parsed snapshot from
+    the cache pool if the file hasn't changed since
+    """
+    cache = ConfigCache(os.path.realpath(cfg_path))
+    config = cache.lookup()
+    if config is None:
+        import yaml
+
+        # Prefer the libyaml C loader, if PyYAML was built with it
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+        with open(cfg_path, 'r') as stream:
+            config = yaml.load(stream, Loader=loader)
+        cache.store(config)
+        cache.save()
+    return config
+
+
+def run(config, action, **options):
     """
     Execute tmux or git workspace related actions
     """
     if action in WORKSPACE_COMMANDS:
+        from .workspace import Workspace
         workspace = Workspace(config)
-        getattr(workspace, action)()
+        result = getattr(workspace, action)(**options)
+        if action == 'freeze':
+            import yaml
+            sys.stdout.write(yaml.safe_dump(result, default_flow_style=False))
 
     # Or, git related actions
     elif action in GIT_COMMANDS:
+        from .git import Git
         git = Git(config)
-        getattr(git, action)()
+        getattr(git, action)(**options)
+
+
+def run_many(patterns, action, jobs=None, **options):
+    """
+    Execute actions on all sessions in the cache pool matching session
+    names or glob patterns, with a single worker pool
+
+    :param patterns: Session names or glob patterns
+    :param action: One of MULTI_COMMANDS
+    :param jobs: Concurrent git processes or sessions
+    """
+    import glob
+    from .workspace import Workspace, WorkspaceException
+    if action in GIT_COMMANDS:
+        from .git import Git as cls
+    else:
+        cls = Workspace
+
+    cfg_paths = []
+    for pattern in patterns:
+        # Skip stale symlinks of moved or deleted workspaces
+        matches = [path for path in sorted(glob.glob(
+            os.path.join(pool_dir(), '{}.yml'.format(pattern))))
+            if os.path.isfile(path)]
+        if not matches and pattern != '*':
+            raise WorkspaceException('No sessions matching', pattern)
+        cfg_paths.extend(path for path in matches if path not in cfg_paths)
+
+    if not cfg_paths:
+        raise WorkspaceException('No sessions matching', ', '.join(patterns))
+    workspaces = [cls(load_config(cfg_path)) for cfg_path in cfg_paths]
+    getattr(cls, '{}_all'.format(action))(workspaces, jobs=jobs, **options)
@@ -1,17 +1,134 @@
 # -*- coding: utf-8 -*-
 import re
 import os
-import subprocess
+import sys
+import time
+from collections import OrderedDict
+from . import process
+from .cache import StatusCache, SummaryCache, pool_dir
 from .logger import Logger
+from .progress import Progress
+from .repository import Repository, RepositoryException
 from .tmux import Tmux
 
 log = Logger()
 
+# Clone settings, in the `clone` section or per repository
+CLONE_OPTIONS = ('depth', 'filter', 'single-branch')
+
+
+def relative_time(seconds):
+    """
+    Describe an age like git's relative dates, e.g. `3 hours ago`
+    """
+    def ago(count, unit):
+        return '{} {}{} ago'.format(count, unit, '' if count == 1 else 's')
+
+    seconds = int(seconds)
+    if seconds < 0:
+        return 'in the future'
+    if seconds < 90:
+        return ago(seconds, 'second')
+    minutes = (seconds + 30) // 60
+    if minutes < 90:
+        return ago(minutes, 'minute')
+    hours = (minutes + 30) // 60
+    if hours < 36:
+        return ago(hours, 'hour')
+    days = (hours + 12) // 24
+    if days < 14:
+        return ago(days, 'day')
+    if days < 70:
+        return ago((days + 3) // 7, 'week')
+    if days < 365:
+        return ago((days + 15) // 30, 'month')
+    if days < 1825:
+        months = (days * 12 * 2 + 365) // (365 * 2)
+        years, months = months // 12, months % 12
+        if months:
+            return '{} year{}, {}'.format(
+                years, '' if years == 1 else 's', ago(months, 'month'))
+        return ago(years, 'year')
+    return ago((days + 183) // 365, 'year')
+
+
+class GitException(Exception):
+    def __init__(self, message, errors=''):
+        super(GitException, self).__init__(message)
+        self.errors = errors
+        self.message = message
+
+
+class FetchParser(object):
+    """
+    Incremental parser of git fetch/clone output, fed line by line as git
+    writes it, with `--progress` counters and reference updates
+    """
+    # Example matches:
+    #
+    #  * [new branch]      1.34.3     -> gogs/1.34.3
+    #  bc23688..8be82ed  develop    -> gogs/develop
+    #  * [new tag]         0.9.1      -> 0.9.1
+    #  - [tag update]      1.19.0     -> 1.19.0
+    #  x [deleted]         (none)     -> origin/foobar
+    _ref = re.compile(
+        r'^\s+([-+*x\ ])\s+\[?([\w\ \.]+)\]?'
+        r'\s{2,}([^\s]+)\s{2,}->\s(.*)$')
+
+    # Example matches:
+    #
+    #  remote: Counting objects:  45% (9/20)
+    #  Receiving objects: 100% (20/20), 1.20 MiB | 2.00 MiB/s, done.
+    #  remote: Total 20 (delta 0), reused 0 (delta 0)
+    _progress = re.compile(
+        r'^(?:remote: )?([A-Z][a-z]+(?: [a-z]+)*): +'
+        r'(?:(\d+)% \((\d+)/(\d+)\)|(\d+))(?:, (.+?))??(?:, done\.)?\s*$')
+
+    def __init__(self, on_progress=None):
+        """
+        :param on_progress: Callback receiving a progress description
+        """
+        self.refs = []
+        self.messages = []
+        self._on_progress = on_progress
+
+    def feed(self, line):
+        """
+        Parse a single line of output, terminated by a newline or a
+        carriage-return
+        """
+        line = line.rstrip('\r\n')
+        match = self._progress.match(line)
+        if match:
+            if self._on_progress:
+                phase, percent, current, total, count, rate = match.groups()
+                self._on_progress('{}: {}{}'.format(
+                    phase,
+                    '{}% ({}/{})'.format(percent, current, total)
+                    if percent else count,
+                    ', ' + rate if rate else ''))
+            return
+
+        match = self._ref.match(line)
+        if match:
+            self.refs.append(match.groups())
+        elif line.strip():
+            self.messages.append(line.strip())
+
+    def error(self):
+        """
+        Returns git's error message, the last message line
+        """
+        return self.messages[-1] if self.messages else 'failed'
+
 
 class Git(object):
     _config = {}
-    _repos = []
     _root = ''
+    _name = ''
+    _jobs = process.DEFAULT_JOBS
+    _timeout = None
+    _mirrors = False
 
     def __init__(self, config):
         """
@@ -20,19 +137,26 @@ class Git(object):
         self._config = config
         self._root = self._config.get('dir') or os.getcwd()
         self._root = os.path.expanduser(self._root)
+        self._name = self._config.get('name') or os.path.basename(self._root)
+        self._jobs = self._config.get('jobs') or process.DEFAULT_JOBS
+        self._timeout = self._config.get('timeout')
+        self._mirrors = bool(self._config.get('mirrors'))
 
         # Collect normalized list of repositories in workspace
+        self._repos = []
         for repo_name in self._config.get('repos', []):
             if isinstance(repo_name, str):
-                repo = {
-                    'name': repo_name,
-                    'url': self._parse_repo_url(repo_name),
-                    'dir': repo_name.split('/')[1]
-                }
+                repo = {'name': repo_name, 'dir': repo_name.split('/')[-1]}
             else:
-                repo = repo_name
-                if 'url' not in repo:
-                    repo['url'] = self._parse_repo_url(repo['name'])
+                repo = dict(repo_name)
+                repo.setdefault('dir', repo['name'].split('/')[-1])
+            if 'url' not in repo:
+                if '/' not in repo['name']:
+                    # A bare name can't be completed into a GitHub URL
+                    raise GitException(
+                        'Repository without an owner requires a `url`',
+                        repo['name'])
+                repo['url'] = self._parse_repo_url(repo['name'])
 
             self._repos.append(repo)
 
@@ -45,205 +169,804 @@ class Git(object):
             url = 'https://github.com/{}.git'.format(repo_name)
         return url or repo_name
 
+    @staticmethod
+    def mirror_path(url):
+        """
+        Returns the path of a URL's bare mirror in the cache pool, keyed by
+        its host and path, e.g. mirrors/github.com/rafi/mx.git for both
+        https://github.com/rafi/mx.git and git@github.com:rafi/mx
+        """
+        key = re.sub(r'^[\w+.-]+://', '', url)
+        key = re.sub(r'^[^/@]+@', '', key).replace(':', '/')
+        key = re.sub(r'\.git$', '', key.rstrip('/'))
+        parts = [part for part in key.split('/')
+                 if part not in ('', '.', '..')]
+        return os.path.join(pool_dir(), 'mirrors', *parts) + '.git'
+
+    def _update_mirror(self, url, progress):
+        """
+        Create or refresh a repository URL's bare mirror, safe to call from
+        a thread
+
+        :param url: Repository URL
+        :param progress: Progress instance
+        :return: Error message, None on success
+        """
+        path = self.mirror_path(url)
+        task = {'name': 'mirror ' + os.path.relpath(path, pool_dir())}
+        if os.path.isfile(os.path.join(path, 'HEAD')):
+            return self._git_progress(
+                ['git', 'fetch', '--prune'], path, task, progress)[1]
+
+        error = self._git_progress(['git', 'clone', '--mirror', url, path],
+                                   None, task, progress)[1]
+        if error is None:
+            # Never prune objects that workspace clones may borrow
+            process.run(['git', 'config', 'gc.pruneExpire', 'never'],
+                        cwd=path)
+        return error
+
     def clone(self):
         """
-        Clone all repositories in project directory
+        Clone all repositories in project directory concurrently
+
+        Repositories that were already cloned are skipped, so an interrupted
+        or partially failed clone resumes where it left off.
         """
-        log.echo(' [blue]::[reset] Fetching git index for project at [white]{}'
+        log.echo(' [blue]::[reset] Cloning git index for project at [white]{}'
                  .format(self._root))
         if not os.path.isdir(self._root):
             os.makedirs(self._root)
-        os.chdir(self._root)
 
-        for repo in self._repos:
-            log.echo(' [blue]::[reset] Cloning [white]{} [boldblack]@ {}'
-                     .format(repo['name'], repo['url']))
-            subprocess.check_output(
-                ['git', 'clone', repo['url']],
-                stderr=subprocess.STDOUT)
+        progress = Progress()
+        pool = process.Pool(self._jobs)
+        counts = {'cloned': 0, 'skipped': 0, 'failed': 0}
+        failed = []
+        for repo, (state, error) in pool.map(
+                lambda repo: self._clone_repo(repo, progress), self._repos):
+            counts[state] += 1
+            if state == 'failed':
+                failed.append(repo['name'])
+            if log.structured:
+                log.record('clone', workspace=self._name, repo=repo['name'],
+                           url=repo['url'], dir=repo['dir'], state=state,
+                           error=error)
+                continue
+            with progress.hidden():
+                if state == 'cloned':
+                    log.echo(' [blue]::[reset] Cloned [white]{}'
+                             ' [boldblack]@ {}'
+                             .format(repo['name'], repo['url']))
+                elif state == 'skipped':
+                    log.echo(' [blue]::[reset] Skipped [white]{}'
+                             ' [boldblack](already cloned)'
+                             .format(repo['name']))
+                else:
+                    log.echo(' [red]::[reset] Failed cloning [white]{}'
+                             ' [boldblack]@ {}'
+                             .format(repo['name'], repo['url']),
+                             '   [red]::[reset] {}'.format(error))
+
+        log.echo(' [blue]::[reset] Cloned [boldgreen]{cloned}[reset],'
+                 ' skipped [boldyellow]{skipped}[reset],'
+                 ' failed [boldred]{failed}[reset]'.format(**counts))
+        if failed:
+            raise GitException(
+                'Failed cloning {} of {} repositories'
+                .format(len(failed), len(self._repos)), ', '.join(failed))
 
-    def fetch(self):
+    def _clone_repo(self, repo, progress):
         """
-        Iterate through all repositories and run git fetch with rich output
+        Clone a single repository, unless it exists, safe to call from a
+        thread
+
+        :param repo: Normalized repository dictionary
+        :param progress: Progress instance
+        :return: (state, error) tuple, state is one of cloned, skipped or
+                 failed
         """
-        log.echo(' [blue]::[reset] Fetching git index for project at [white]{}'
-                 .format(self._root))
-# Debugging:
-#        with open('output_example.txt') as f:
-#            output = f.read()
-#        self._parse_git_fetch(output)
-#        return
+        path = os.path.join(self._root, repo['dir'])
+        if Repository.find_git_dir(path):
+            return 'skipped', None
+        if os.path.exists(path) and (
+                not os.path.isdir(path) or os.listdir(path)):
+            return 'failed', 'Path exists and is not a git repository'
+
+        args = self._clone_args(repo)
+        if self._mirrors:
+            # Borrow objects from the mirror, clone normally if it failed
+            self._update_mirror(repo['url'], progress)
+            args.extend(['--reference-if-able',
+                         self.mirror_path(repo['url'])])
+
+        error = self._git_progress(
+            ['git', 'clone'] + args + [repo['url'], path],
+            self._root, repo, progress)[1]
+        return ('failed', error) if error is not None else ('cloned', None)
+
+    def _clone_args(self, repo):
+        """
+        Build git clone arguments from the `clone` section, overridden by
+        the repository's own settings
+
+        :param repo: Normalized repository dictionary
+        :return: List of arguments
+        """
+        options = dict(self._config.get('clone') or {})
+        options.update((key, repo[key]) for key in CLONE_OPTIONS
+                       if key in repo)
+
+        args = []
+        if options.get('depth'):
+            args.append('--depth={}'.format(options['depth']))
+        if options.get('filter'):
+            args.append('--filter={}'.format(options['filter']))
+        if options.get('single-branch') is not None:
+            args.append('--single-branch' if options['single-branch']
+                        else '--no-single-branch')
+        return args
+
+    def fetch(self, stale=None, budget=None):
+        """
+        Fetch all repositories concurrently and print a rich summary for
+        each repository as soon as it finishes
+
+        :param stale: Skip repositories fetched within these minutes
+        :param budget: Seconds after which no new fetches are started
+        """
+        self.fetch_all([self], self._jobs, stale, budget)
+
+    @classmethod
+    def fetch_all(cls, workspaces, jobs=None, stale=None, budget=None):
+        """
+        Fetch repositories of several workspaces with a single worker pool
+
+        Repositories shared between workspaces are fetched once. Output is
+        grouped in per-workspace sections, the current section's summaries
+        are printed as soon as each repository finishes, while later
+        sections catch up once the current one is complete.
+
+        Repositories are fetched by descending `priority`, then the least
+        recently fetched first, so a time budget is spent where it matters.
+
+        :param workspaces: List of Git instances
+        :param jobs: Concurrent git processes (default: largest `jobs`)
+        :param stale: Skip repositories fetched within these minutes
+        :param budget: Seconds after which no new fetches are started
+        """
+        tasks = cls._unique_repos(workspaces)
+        pool = process.Pool(jobs or max(git._jobs for git in workspaces))
+        progress = Progress()
+        deadline = time.time() + budget if budget else None
+
+        results = {}
+        queue = []
+        for path, (git, repo) in tasks.items():
+            fetched = git._last_fetch(repo)
+            if stale and fetched and time.time() - fetched < stale * 60:
+                results[path] = (None, None, 'fetched {} minutes ago'.format(
+                    int((time.time() - fetched) // 60)))
+            else:
+                queue.append((-repo.get('priority', 0), fetched or 0, path))
+        queue = [path for _, _, path in sorted(queue)]
+        # Only mirrors of repositories about to be fetched are refreshed
+        cls._update_mirrors(workspaces, OrderedDict(
+            (path, tasks[path]) for path in queue), pool, progress, deadline)
+
+        def fetch(path):
+            # Queued fetches start in order, stop starting them once late
+            if deadline and time.time() > deadline:
+                return None, None, 'out of time budget'
+            return tasks[path][0]._fetch_repo(tasks[path][1], progress) + \
+                (None,)
+
+        failed = []
+        current = 0
+        workspaces[current]._fetch_section(results)
+        for path, (refs, error, skipped) in pool.map(fetch, queue):
+            results[path] = (refs, error, skipped)
+            if error is not None:
+                failed.append(tasks[path][1]['name'])
+
+            with progress.hidden():
+                git = workspaces[current]
+                for repo in git._repos:
+                    if git._repo_path(repo) == path:
+                        git._fetch_entry(repo, refs, error, skipped)
+
+                # Move on to the next sections once the current one is done
+                while current < len(workspaces) - 1 and all(
+                        git._repo_path(repo) in results
+                        for repo in git._repos):
+                    current += 1
+                    git = workspaces[current]
+                    git._fetch_section(results)
+
+        for git in workspaces[current + 1:]:
+            git._fetch_section(results)
+
+        skipped = [path for path in tasks if results[path][2] is not None]
+        if skipped:
+            log.echo(' [blue]::[reset] Skipped [boldyellow]{}[reset] of {}'
+                     ' repositories'.format(len(skipped), len(tasks)))
+
+        for git in workspaces:
+            summary = SummaryCache(git._name)
+            summary.update({
+                'fetch_time': int(time.time()),
+                'fetch_failed': sum(
+                    1 for repo in git._repos
+                    if results[git._repo_path(repo)][1] is not None)})
+            summary.save()
+
+        if failed:
+            raise GitException(
+                'Failed fetching {} of {} repositories'
+                .format(len(failed), len(tasks)), ', '.join(failed))
+
+    @staticmethod
+    def _update_mirrors(workspaces, tasks, pool, progress, deadline=None):
+        """
+        Refresh each mirror used by workspaces once, before their
+        repositories are fetched from it
+
+        :param workspaces: List of Git instances
+        :param tasks: Unique repositories, see _unique_repos()
+        :param pool: Pool instance
+        :param progress: Progress instance
+        :param deadline: Time after which no new mirror updates are started
+        """
+        urls = OrderedDict()
+        for git, repo in tasks.values():
+            if git._mirrors and os.path.isdir(git.mirror_path(repo['url'])):
+                urls.setdefault(git.mirror_path(repo['url']), (git, repo))
+        if not urls:
+            return
+
+        log.echo(' [blue]::[reset] Updating [white]{}[reset] mirrors'
+                 .format(len(urls)))
+
+        def update(path):
+            # A fetch budget also bounds the mirror phase
+            if deadline and time.time() > deadline:
+                return None
+            return urls[path][0]._update_mirror(urls[path][1]['url'],
+                                                progress)
+
+        for path, error in pool.map(update, urls):
+            if error is not None:
+                log.record('mirror', path=path, error=error)
+                with progress.hidden():
+                    log.echo(' [red]::[reset] Failed updating mirror'
+                             ' [white]{}'.format(path),
+                             '   [red]::[reset] {}'.format(error))
+
+    def _fetch_section(self, results):
+        """
+        Print a workspace's fetch section header, along with summaries of its
+        repositories that were already fetched
+
+        :param results: Dictionary of repository paths to (refs, error,
+                        skipped) tuples
+        """
+        log.echo(' [blue]::[reset] Fetching git index for project'
+                 ' [boldyellow]{}[reset] at [white]{}'
+                 .format(self._name, self._root))
         for repo in self._repos:
-            log.echo(' [blue]::[reset] Fetching [white]{} [boldblack]@ {}'
-                     .format(repo['name'], repo['url']))
-            os.chdir(self._root)
-            os.chdir(repo['dir'])
-            output = subprocess.check_output(
-                ['git', 'fetch', '--all', '--tags', '--prune'],
-                stderr=subprocess.STDOUT)
-            self._parse_git_fetch(output.decode('utf_8'))
+            path = self._repo_path(repo)
+            if path in results:
+                self._fetch_entry(repo, *results[path])
 
-    def _parse_git_fetch(self, output):
+    def _fetch_entry(self, repo, refs, error, skipped=None):
         """
-        Parse and beautify git's raw fetch summary
+        Print a repository's fetch summary
 
-        :param output: Git's raw fetch output
+        :param refs: Reference updates parsed by FetchParser
+        :param error: Error message, None on success
+        :param skipped: Reason the repository wasn't fetched, if it wasn't
         """
+        if log.structured:
+            log.record('fetch', workspace=self._name, repo=repo['name'],
+                       url=repo['url'], dir=repo['dir'], error=error,
+                       skipped=skipped, refs=[
+                           {'flag': flag, 'summary': summary,
+                            'from': source, 'to': destination}
+                           for flag, summary, source, destination
+                           in refs or []])
+        elif skipped is not None:
+            log.echo(' [blue]::[reset] Skipped [white]{}'
+                     ' [boldblack]({})'.format(repo['name'], skipped))
+        elif error is None:
+            log.echo(' [blue]::[reset] Fetched [white]{}'
+                     ' [boldblack]@ {}'
+                     .format(repo['name'], repo['url']),
+                     *self._format_fetch(refs))
+        else:
+            log.echo(' [red]::[reset] Failed fetching [white]{}'
+                     ' [boldblack]@ {}'
+                     .format(repo['name'], repo['url']),
+                     '   [red]::[reset] {}'.format(error))
+
+    def _last_fetch(self, repo):
+        """
+        Returns the time a repository was last fetched, or None
+        """
+        try:
+            return Repository(
+                os.path.join(self._root, repo['dir'])).last_fetch()
+        except RepositoryException:
+            return None
+
+    def _fetch_repo(self, repo, progress):
+        """
+        Run git fetch in a single repository, safe to call from a thread
+
+        :param repo: Normalized repository dictionary
+        :param progress: Progress instance
+        :return: (refs, error) tuple, error is None on success
+        """
+        return self._git_progress(
+            ['git', 'fetch', '--all', '--tags', '--prune'],
+            os.path.join(self._root, repo['dir']), repo, progress)
+
+    def _git_progress(self, args, cwd, repo, progress):
+        """
+        Run a git fetch or clone, parsing its output as it arrives and
+        displaying its progress
+
+        :param args: Git command arguments
+        :param cwd: Working directory
+        :param repo: Normalized repository dictionary
+        :param progress: Progress instance
+        :return: (refs, error) tuple, error is None on success
+        """
+        if progress.enabled:
+            args = args + ['--progress']
+        parser = FetchParser(lambda text: progress.update(
+            repo['name'], '   [{}] {}'.format(repo['name'], text)))
+        try:
+            result = process.run(args, cwd=cwd, timeout=self._timeout,
+                                 merge_stderr=True, on_stdout=parser.feed)
+        finally:
+            progress.done(repo['name'])
+        if result.ok:
+            return parser.refs, None
+        return parser.refs, result.error or parser.error()
+
+    @staticmethod
+    def _format_fetch(refs):
+        """
+        Beautify reference updates parsed by FetchParser
+
+        :param refs: List of (flag, summary, source, destination) tuples
+        :return: List of colorized summary lines
+        """
+        lines = []
         branches = {'created': [], 'updated': []}
         tags = {'created': [], 'updated': []}
         deleted = []
-        # Example matches:
-        #
-        #  * [new branch]      1.34.3     -> gogs/1.34.3
-        #  bc23688..8be82ed  develop    -> gogs/develop
-        #  * [new tag]         0.9.1      -> 0.9.1
-        #  - [tag update]      1.19.0     -> 1.19.0
-        #  - [tag update]      1.19.1     -> 1.19.1
-        #  - [tag update]      1.19.2     -> 1.19.2
-        #  * [new tag]         1.19.3     -> 1.19.3
-        #  * [new tag]         1.19.4     -> 1.19.4
-        #  x [deleted]         (none)     -> origin/foobar
-        regex = re.compile(
-            r'^\s+([-+*x\ ])\s+\[?([\w\ \.]+)\]?'
-            '\s{2,}([^\s]+)\s{2,}->\s(.*)$',
-            flags=re.MULTILINE
-        )
-        for match in regex.finditer(output):
-            remote = match.group(4)
-            if match.group(2).find('new') > -1:
+        for _, summary, _, remote in refs:
+            if summary.find('new') > -1:
                 action = 'created'
             else:
                 action = 'updated'
 
-            if match.group(2) == 'deleted':
+            if summary == 'deleted':
                 deleted.append(remote)
-            if match.group(2).find('tag') > -1:
+            if summary.find('tag') > -1:
                 tags[action].append(remote)
             else:
                 branches[action].append(remote)
 
         for action in ['created', 'updated']:
             if tags[action] or branches[action]:
-                log.echo('   [{}]::[reset] {}'
-                         ' {}[yellow]([boldyellow]{}[yellow])[reset]'
-                         ' {}[yellow]([boldred]{}[yellow])[reset]'
-                         .format(
-                             'green' if action == 'created' else 'yellow',
-                             action.title(),
-                             'tags: ' if tags[action] else '',
-                             ', '.join(tags[action]),
-                             'branches: ' if branches[action] else '',
-                             ', '.join(branches[action])))
+                lines.append('   [{}]::[reset] {}'
+                             ' {}[yellow]([boldyellow]{}[yellow])[reset]'
+                             ' {}[yellow]([boldred]{}[yellow])[reset]'
+                             .format(
+                                 'green' if action == 'created' else 'yellow',
+                                 action.title(),
+                                 'tags: ' if tags[action] else '',
+                                 ', '.join(tags[action]),
+                                 'branches: ' if branches[action] else '',
+                                 ', '.join(branches[action])))
         if deleted:
-            log.echo('   [red]::[reset] Deleted:'
-                     ' [yellow]([boldred]{}[yellow])[reset]'
-                     .format(', '.join(deleted)))
+            lines.append('   [red]::[reset] Deleted:'
+                         ' [yellow]([boldred]{}[yellow])[reset]'
+                         .format(', '.join(deleted)))
+        return lines
+
+    def status(self, refresh=False, watch=False):
+        """
+        Collect repositories' status concurrently and display a colorful
+        status table, in the order repositories are configured
+
+        Branch, upstream and last commit of repositories whose git metadata
+        didn't change since the previous run are read from the status cache,
+        only modified and untracked files are counted again.
+
+        :param refresh: Ignore the cache and recompute all repositories
+        :param watch: Keep refreshing the table as repositories change
+        """
+        self.status_all([self], refresh, self._jobs, watch)
+
+    @classmethod
+    def status_all(cls, workspaces, refresh=False, jobs=None, watch=False):
+        """
+        Display status of several workspaces, collected with a single worker
+        pool. Repositories shared between workspaces are inspected once.
+
+        :param workspaces: List of Git instances
+        :param refresh: Ignore the cache and recompute all repositories
+        :param jobs: Concurrent git processes (default: largest `jobs`)
+        :param watch: Keep refreshing the table as repositories change
+        """
+        tasks = cls._unique_repos(workspaces)
+        caches = dict((git._name, StatusCache(git._name))
+                      for git in workspaces)
+        jobs = jobs or max(git._jobs for git in workspaces)
+        rows = process.Pool(jobs).map(
+            lambda path: tasks[path][0]._cached_status(
+                tasks[path][1], caches[tasks[path][0]._name], refresh),
+            tasks, ordered=True)
+
+        results = {}
+        for git in workspaces:
+            is_on = git._status_header()
+
+            # Repositories are collected in order, wait for the next one
+            for repo in git._repos:
+                path = git._repo_path(repo)
+                while path not in results:
+                    done, row = next(rows)
+                    results[done] = row
+                git._status_entry(repo, results[path], is_on)
+            git._save_summary(
+                is_on, [results[git._repo_path(repo)] for repo in git._repos])
 
-    def status(self):
+        rows.close()
+        for cache in caches.values():
+            cache.save()
+
+        if watch:
+            cls._watch_status(workspaces, tasks, caches, jobs, results)
+
+    @classmethod
+    def _watch_status(cls, workspaces, tasks, caches, jobs, results):
         """
-        Iterate through repositories and display a colorful status
+        Redraw the status table whenever repositories' index, HEAD or refs
+        change, recomputing only those, until interrupted
+
+        :param workspaces: List of Git instances
+        :param tasks: Unique repositories, see _unique_repos()
+        :param caches: Dictionary of workspace names to StatusCache
+        :param jobs: Concurrent git processes
+        :param results: Dictionary of repository paths to status rows
+        """
+        from .watch import Watcher
+
+        watcher = Watcher(tasks)
+        try:
+            while True:
+                changed = watcher.wait()
+                for path, row in process.Pool(jobs).map(
+                        lambda path: tasks[path][0]._cached_status(
+                            tasks[path][1], caches[tasks[path][0]._name]),
+                        changed):
+                    results[path] = row
+
+                if sys.stdout.isatty() and not log.structured:
+                    # Clear screen, scrollback is kept
+                    sys.stdout.write('\x1b[H\x1b[2J')
+                for git in workspaces:
+                    is_on = git._status_header()
+                    rows = [results[git._repo_path(repo)]
+                            for repo in git._repos]
+                    for repo, row in zip(git._repos, rows):
+                        git._status_entry(repo, row, is_on)
+                    git._save_summary(is_on, rows)
+                for cache in caches.values():
+                    cache.save()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
+    def _status_entry(self, repo, row, is_on):
+        """
+        Print a repository's status row, or its structured record
+
+        :param repo: Normalized repository dictionary
+        :param row: Status dictionary
+        :param is_on: Whether the workspace's session exists
+        """
+        if log.structured:
+            log.record('status', workspace=self._name, session=is_on,
+                       repo=repo['name'], dir=repo['dir'], **row)
+        else:
+            log.echo(self._format_status(repo, row))
+
+    def _status_header(self):
+        """
+        Print the workspace's status header with its session state
+
+        :return: True if the workspace's session exists
         """
         session_name = self._config.get('name')
-        is_on = Tmux().has_session(session_name)
+        is_on = Tmux(self._config.get('tmux_socket')).has_session(
+            session_name)
         log.echo(' [blue]::[reset] Session [boldyellow]{}[reset]: {}'
                  .format(session_name,
                          '[boldgreen]on' if is_on else '[boldred]off'))
+        return is_on
 
-        # Compatibility for python 2.x, doesn't have subprocess.DEVNULL
-        DEVNULL = open(os.devnull, 'wb')
+    def _save_summary(self, is_on, rows):
+        """
+        Save the workspace's summary for `mx prompt`
 
-        for repo in self._repos:
-            os.chdir(self._root)
-            os.chdir(repo['dir'])
-
-            try:
-                output = subprocess.check_output(
-                    ['git', 'symbolic-ref', '-q', 'HEAD'],
-                    stderr=DEVNULL)
-                detached = False
-            except subprocess.CalledProcessError:
-                detached = True
-
-            output = subprocess.check_output(['git', 'diff', '--shortstat'])
-            modified = re.match(r'^\s*(\d)', output.decode('utf_8'))
-            modified = '≠' + str(modified.group(1)) if modified else ''
-
-            output = subprocess.check_output(
-                ['git', 'ls-files', '--others', '--exclude-standard'],
-                stderr=DEVNULL).decode('utf-8')
-            untracked = len(output.split('\n')) - 1
-            untracked = '?' + str(untracked) if untracked > 0 else ''
-
-            current = subprocess.check_output([
-                'git', 'log', '-1', '--color=always',
-                '--format=%C(auto)%D %C(black bold)(%aN %ar)%Creset'
-            ]).decode('utf-8').strip()
-
-            if detached:
-                position = 'detach'
-            else:
-                output = subprocess.check_output([
-                    'git', 'rev-parse', '--abbrev-ref', 'HEAD'])
-                branch = output.decode('utf-8').strip()
+        :param is_on: Whether the workspace's session exists
+        :param rows: Status dictionaries of the workspace's repositories
+        """
+        summary = SummaryCache(self._name)
+        summary.update({
+            'session': is_on,
+            'status_time': int(time.time()),
+            'dirty': sum(1 for row in rows
+                         if row['modified'] or row['untracked']),
+            'ahead': sum(row['ahead'] or 0 for row in rows),
+            'behind': sum(row['behind'] or 0 for row in rows)})
+        summary.save()
+
+    @staticmethod
+    def _unique_repos(workspaces):
+        """
+        Collect repositories of workspaces, without duplicates
+
+        :param workspaces: List of Git instances
+        :return: Ordered dictionary of repository real-paths to their first
+                 (workspace, repository) occurrence
+        """
+        tasks = OrderedDict()
+        for git in workspaces:
+            for repo in git._repos:
+                tasks.setdefault(git._repo_path(repo), (git, repo))
+        return tasks
+
+    def _repo_path(self, repo):
+        """
+        Returns a repository's real path, unique across workspaces
+        """
+        return os.path.realpath(os.path.join(self._root, repo['dir']))
+
+    def _cached_status(self, repo, cache, refresh=False):
+        """
+        Collect a single repository's status, reusing its cached branch,
+        upstream and last commit while they're still valid, safe to call
+        from a thread
+
+        :param repo: Normalized repository dictionary
+        :param cache: StatusCache instance
+        :param refresh: Ignore the cached refs
+        :return: Status dictionary
+        """
+        path = os.path.join(self._root, repo['dir'])
+        try:
+            fingerprint = Repository(path).fingerprint()
+        except RepositoryException:
+            fingerprint = None
+
+        refs = None if refresh else cache.lookup(path, fingerprint)
+        if refs and refs.get('color') != (not log.structured):
+            # Cached for the other output mode, describe the commit again
+            refs = None
+        row, fresh_refs = self._repo_status(repo, refs)
+        if refs is None and not row['error']:
+            cache.store(path, fingerprint, fresh_refs)
+        return row
+
+    def _repo_status(self, repo, refs=None):
+        """
+        Collect a single repository's status, safe to call from a thread
+
+        Branch and upstream are read in-process from the repository's
+        metadata. Modified and untracked counts, and ahead/behind when the
+        branch and its upstream differ, come from a single
+        `git status --porcelain=v2` invocation. The last commit is
+        described by `git log`.
+
+        :param repo: Normalized repository dictionary
+        :param refs: Previously collected refs, only the work-tree is
+                     inspected
+        :return: (status dictionary, refs) tuple, refs hold what depends
+                 on the repository's refs only and can be cached
+        """
+        path = os.path.join(self._root, repo['dir'])
+        row = {'branch': None, 'upstream': None, 'detached': False,
+               'ahead': None, 'behind': None, 'modified': 0,
+               'untracked': 0, 'current': '', 'error': None}
+
+        # Without optional locks, status never rewrites the index, which
+        # would invalidate the cache and wake up watchers
+        cmd = ['git', '--no-optional-locks', 'status', '--porcelain=v2',
+               '--untracked-files=all']
+        position = self._read_position(path) if refs is None else refs
+        if position is None:
+            cmd.insert(3, '--branch')
+        else:
+            row.update((key, value) for key, value in position.items()
+                       if key in row)
+            if row['upstream'] and row['ahead'] is None:
+                # Let git count commits of diverged branches
+                cmd.insert(3, '--branch')
+
+        # Stream porcelain output line by line, untracked entries can be
+        # numerous on large repositories and aren't kept around.
+        result = process.run(
+            cmd, cwd=path,
+            on_stdout=lambda line: self._parse_porcelain_line(line, row))
+        if not result.ok:
+            row['error'] = result.error or 'not a git repository'
+            return row, None
+        if refs is not None:
+            row['current'] = self._format_commit(refs)
+            return row, refs
+
+        if position is None and not row['upstream'] and not row['detached']:
+            # No upstream is configured, compare with origin's namesake
+            row['upstream'] = 'origin/{}'.format(row['branch'])
+
+        if row['upstream'] and row['ahead'] is None:
+            result = process.run(
+                ['git', 'rev-list', '--left-right', '--count',
+                 'HEAD...{}'.format(row['upstream'])], cwd=path)
+            if result.ok:
+                ahead, behind = result.stdout.split()
+                row['ahead'], row['behind'] = int(ahead), int(behind)
+
+        # Relative commit time is rendered at display time, so it doesn't
+        # freeze in the cache. Structured records are never colored.
+        refs = dict((key, row[key]) for key in (
+            'branch', 'upstream', 'detached', 'ahead', 'behind'))
+        refs['color'] = not log.structured
+        result = process.run([
+            'git', 'log', '-1',
+            '--color=always' if refs['color'] else '--color=never',
+            '--format=%at %C(auto)%D %C(black bold)(%aN'], cwd=path)
+        timestamp, _, refs['commit'] = result.stdout.strip().partition(' ')
+        refs['commit_time'] = int(timestamp) if timestamp.isdigit() else None
+        row['current'] = self._format_commit(refs)
+        return row, refs
+
+    @staticmethod
+    def _format_commit(refs):
+        """
+        Describe the last commit, its refs, author and relative time
+        """
+        if refs.get('commit_time') is None:
+            return ''
+        return '{} {}){}'.format(refs['commit'], relative_time(
+            time.time() - refs['commit_time']),
+            '\x1b[m' if refs.get('color') else '')
+
+    @staticmethod
+    def _read_position(path):
+        """
+        Resolve branch and upstream in-process, without spawning git
+
+        Ahead/behind counts are only filled in when they're trivially known,
+        i.e. the branch and its upstream point to the same commit.
+
+        :param path: Repository work-tree root
+        :return: Partial status dictionary, or None if the repository's
+                 layout isn't supported and git must be consulted
+        """
+        try:
+            repo = Repository(path)
+            branch, sha = repo.head()
+            if branch is None:
+                return {'detached': True}
+
+            position = {'branch': branch}
+            upstream, ref = repo.upstream(branch)
+            if upstream is None:
+                # No upstream is configured, compare with origin's namesake
                 upstream = 'origin/{}'.format(branch)
-                try:
-                    output = subprocess.check_output(
-                        ['git', 'rev-parse', '--abbrev-ref', '@{upstream}'],
-                        stderr=DEVNULL)
-                    upstream = output.decode('utf-8').strip()
-                except subprocess.CalledProcessError:
-                    pass
-
-                position = ''
-                try:
-                    output = subprocess.check_output([
-                        'git', 'rev-list', '--left-right',
-                        branch, '...', upstream
-                    ], stderr=subprocess.STDOUT).decode('utf-8')
-                    ahead = len(re.findall(r'\<', output))
-                    behind = len(re.findall(r'\>', output))
-                    position = '{}{}'.format(
-                        '▲' + str(ahead) if ahead else '',
-                        '▼' + str(behind) if behind else '',
-                    )
-                except subprocess.CalledProcessError:
-                    position = 'n/a'
-
-            name = repo['name']
-            if repo['name'].split('/')[1] != repo['dir']:
-                name = repo['dir']
-
-            log.echo('   [white]{:>30} '
-                     ' [boldred]{:3} [boldblue]{:3} [boldmagenta]{:7}'
-                     ' [reset]{}'
-                     .format(
-                         name, modified, untracked,
-                         position, current))
-
-        DEVNULL.close()
+                ref = 'refs/remotes/{}'.format(upstream)
+                if repo.resolve(ref) is None:
+                    return position
+
+            position['upstream'] = upstream
+            if sha and sha == repo.resolve(ref):
+                position['ahead'] = position['behind'] = 0
+            return position
+        except RepositoryException:
+            return None
 
     @staticmethod
-    def is_git_repo():
+    def _parse_porcelain_line(line, row):
         """
-        Check if current directory is a Git repository
+        Accumulate a single `git status --porcelain=v2 --branch` line
+
+        :param line: Raw porcelain line
+        :param row: Status dictionary to update
+        """
+        if line.startswith('? '):
+            row['untracked'] += 1
+        elif line[:2] in ('1 ', '2 ', 'u '):
+            # Second XY character is the work-tree status
+            if line[3] != '.':
+                row['modified'] += 1
+        elif line.startswith('# branch.head '):
+            head = line[14:].strip()
+            row['detached'] = head == '(detached)'
+            row['branch'] = None if row['detached'] else head
+        elif line.startswith('# branch.upstream '):
+            row['upstream'] = line[18:].strip()
+        elif line.startswith('# branch.ab '):
+            ahead, behind = line[12:].split()
+            row['ahead'], row['behind'] = int(ahead), -int(behind)
+
+    @staticmethod
+    def _format_status(repo, row):
+        """
+        Render a repository's status dictionary as a colorful table row
+
+        :param repo: Normalized repository dictionary
+        :param row: Status dictionary, see `_repo_status`
+        """
+        name = repo['name']
+        if repo['name'].split('/')[-1] != repo['dir']:
+            name = repo['dir']
+
+        if row['error']:
+            return '   [white]{:>30}  [red]{}'.format(name, row['error'])
+
+        modified = '≠' + str(row['modified']) if row['modified'] else ''
+        untracked = '?' + str(row['untracked']) if row['untracked'] else ''
+        if row['detached']:
+            position = 'detach'
+        elif row['ahead'] is None:
+            position = 'n/a'
+        else:
+            position = '{}{}'.format(
+                '▲' + str(row['ahead']) if row['ahead'] else '',
+                '▼' + str(row['behind']) if row['behind'] else '',
+            )
+
+        return ('   [white]{:>30} '
+                ' [boldred]{:3} [boldblue]{:3} [boldmagenta]{:7}'
+                ' [reset]{}'
+                .format(name, modified, untracked, position, row['current']))
+
+    @staticmethod
+    def is_git_repo(path=None):
+        """
+        Check if a directory is within a Git repository
+
+        :param path: Directory to check (default: current directory)
         """
         try:
-            subprocess.check_output(
-                ['git', 'rev-parse', '--is-inside-work-tree'],
-                stderr=subprocess.STDOUT)
-            return True
-        except subprocess.CalledProcessError:
-            return False
+            return Repository.discover(path or os.getcwd()) is not None
+        except RepositoryException:
+            pass
+
+        return process.run(['git', 'rev-parse', '--is-inside-work-tree'],
+                           cwd=path).ok
 
     @staticmethod
-    def get_remote_url():
+    def get_remote_url(path=None):
         """
-        Returns the current directory's Git repository remote URL
+        Returns a Git repository's origin remote URL
+
+        :param path: Repository directory (default: current directory)
         """
         try:
-            url = subprocess.check_output(
-                ['git', 'config', '--get', 'remote.origin.url'],
-                stderr=subprocess.STDOUT)
-            return url.decode('utf-8').strip()
-        except subprocess.CalledProcessError:
-            return False
+            repo = Repository.discover(path or os.getcwd())
+            if repo:
+                return repo.remote_url() or False
+        except RepositoryException:
+            pass
+
+        result = process.run(['git', 'config', '--get', 'remote.origin.url'],
+                             cwd=path)
+        return result.stdout.strip() if result.ok else False
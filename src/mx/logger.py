@@ -1,28 +1,88 @@
 # -*- coding: utf-8 -*-
+import json
 import sys
 import re
 
 
 class Logger(object):
     """
-    Terminal logger with color-support
+    Terminal logger with color-support, or a structured records writer
     """
     _is_tty = sys.stdout.isatty()
     _colors = {'reset': 0, 'black': 30, 'white': 37,
                'cyan': 36, 'magenta': 35, 'blue': 34,
                'yellow': 33, 'green': 32, 'red': 31}
+    _tag = re.compile(r'\[(bold)?([a-z]+)\]')
+    _ansi = re.compile(r'\x1b\[[0-9;]*m')
+
+    # Structured output format: None, json or ndjson
+    _format = None
+    _records = 0
+
+    @classmethod
+    def set_format(cls, output_format):
+        """
+        Switch all loggers to structured records, or back to text
+
+        :param output_format: json, ndjson, or None for colored text
+        """
+        cls._format = output_format if output_format != 'text' else None
+        cls._records = 0
+
+    @property
+    def structured(self):
+        return self._format is not None
 
     def echo(self, *args):
         """
-        Prints text to terminal with color codes
+        Prints text to terminal with color codes, nothing is printed in
+        structured mode
         Example:
           log.echo('[green]hey [boldred]there!')
 
         :param args: Multiple string messages
         """
+        if self._format:
+            return
         for arg in args:
-            msg = re.sub(r'\[(bold)?([a-z]+)\]', self._colorize, arg)
-            print(''.join([msg, '\x1b[0m']))
+            if '[' in arg:
+                arg = self._tag.sub(self._colorize, arg)
+            print(''.join([arg, '\x1b[0m']))
+
+    def record(self, kind, **fields):
+        """
+        Write a single structured record, when in structured mode. ndjson
+        records are written one per line, json records as items of an
+        array, finished by `close()`.
+
+        :param kind: Record type, e.g. status
+        :param fields: Record fields, strings are stripped of ANSI codes
+        """
+        if not self._format:
+            return
+        record = {'type': kind}
+        for key, value in fields.items():
+            if isinstance(value, str) and '\x1b' in value:
+                value = self._ansi.sub('', value)
+            record[key] = value
+
+        line = json.dumps(record, sort_keys=True)
+        if self._format == 'json':
+            line = ('[\n' if not Logger._records else ',\n') + line
+        else:
+            line += '\n'
+        Logger._records += 1
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+    def close(self):
+        """
+        Finish structured output, closing the json array
+        """
+        if self._format == 'json':
+            sys.stdout.write('\n]\n' if Logger._records else '[]\n')
+            sys.stdout.flush()
+            Logger._records = 0
 
     def _colorize(self, match):
         if not self._is_tty:
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+import itertools
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from . import trace
+
+# Default number of concurrent processes
+DEFAULT_JOBS = 8
+
+
+class Result(namedtuple('Result', [
+        'args',        # Executed command
+        'returncode',  # Exit code, None if it didn't run or complete
+        'stdout',      # Captured output, empty when streamed to a callback
+        'stderr',      # Captured errors, empty when streamed or merged
+        'start',       # Start time, seconds since the epoch
+        'duration',    # Wall-clock duration in seconds
+        'error'])):    # Reason the process didn't complete, or None
+    """
+    Structured outcome of a command executed with `run()`
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+
+# Running processes, mapped to the name of the thread that started them
+_running = {}
+_running_lock = threading.Lock()
+_local = threading.local()
+
+
+def run(args, cwd=None, timeout=None, input=None, merge_stderr=False,
+        on_stdout=None, on_stderr=None):
+    """
+    Run a command to completion and capture its output
+
+    Both pipes are always drained, so a chatty process can't deadlock. A
+    stream handed to a callback is decoded and delivered line by line, split
+    on both newlines and carriage-returns, instead of being buffered.
+
+    :param args: Command arguments list, or a string to run with the shell
+    :param cwd: Working directory
+    :param timeout: Seconds to wait before killing the process
+    :param input: Text written to the process's standard input
+    :param merge_stderr: Capture stderr into stdout, like `2>&1`
+    :param on_stdout: Callback receiving stdout lines
+    :param on_stderr: Callback receiving stderr lines
+    :return: Result
+    """
+    start = time.time()
+    if _is_cancelled():
+        return Result(args, None, '', '', start, 0, 'cancelled')
+
+    try:
+        process = subprocess.Popen(
+            args, cwd=cwd, shell=not isinstance(args, list),
+            stdin=subprocess.PIPE if input is not None else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE)
+    except OSError as e:
+        return _traced(Result(args, None, '', '', start, time.time() - start,
+                              e.strerror), 0, cwd)
+
+    with _running_lock:
+        _running[process] = threading.current_thread().name
+    if _is_cancelled():
+        # Pool was cancelled while the process was being spawned
+        process.kill()
+    try:
+        if on_stdout or on_stderr:
+            stdout, stderr, error, size = _stream(
+                process, timeout, input, on_stdout, on_stderr)
+        else:
+            stdout, stderr, error, size = _communicate(
+                process, timeout, input)
+    finally:
+        with _running_lock:
+            _running.pop(process, None)
+
+    if error is None and process.returncode < 0:
+        error = 'cancelled' if _is_cancelled() \
+            else 'killed by signal {}'.format(-process.returncode)
+    return _traced(Result(args, None if error else process.returncode,
+                          stdout, stderr, start, time.time() - start, error),
+                   size, cwd)
+
+
+def _traced(result, size, cwd=None):
+    """
+    Record a finished command, if tracing is enabled
+
+    :param size: Bytes of output the command wrote
+    :param cwd: Working directory the command ran in
+    """
+    if trace.enabled():
+        name, category = trace.command_name(result.args)
+        trace.record(name, category, result.start, result.duration,
+                     returncode=result.returncode, bytes=size,
+                     error=result.error, cwd=cwd)
+    return result
+
+
+def _is_cancelled():
+    """
+    Returns true if the current pool worker's pool was cancelled
+    """
+    cancelled = getattr(_local, 'cancelled', None)
+    return cancelled is not None and cancelled.is_set()
+
+
+def _communicate(process, timeout, input):
+    """
+    Wait for a process, capturing all of its output
+    """
+    error = None
+    try:
+        stdout, stderr = process.communicate(input=_encode(input),
+                                             timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        stdout, stderr = process.communicate()
+        error = 'timed out after {}s'.format(timeout)
+    return _decode(stdout), _decode(stderr), error, \
+        len(stdout or b'') + len(stderr or b'')
+
+
+def _stream(process, timeout, input, on_stdout, on_stderr):
+    """
+    Wait for a process, reading its pipes in threads and feeding lines to
+    callbacks as they arrive
+    """
+    buffers = {}
+    sizes = []
+    readers = []
+    for name, pipe, callback in (('stdout', process.stdout, on_stdout),
+                                 ('stderr', process.stderr, on_stderr)):
+        if pipe is None:
+            continue
+        buffers[name] = []
+        reader = threading.Thread(
+            target=_read_lines,
+            args=(pipe, callback or buffers[name].append, sizes))
+        reader.daemon = True
+        reader.start()
+        readers.append(reader)
+
+    if input is not None:
+        try:
+            process.stdin.write(_encode(input))
+        except (IOError, OSError):
+            pass
+        process.stdin.close()
+
+    error = None
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        error = 'timed out after {}s'.format(timeout)
+    for reader in readers:
+        # Grandchildren (e.g. ssh) may hold pipes open, don't wait forever
+        reader.join(timeout=1)
+
+    return (''.join(buffers.get('stdout', [])),
+            ''.join(buffers.get('stderr', [])), error, sum(sizes))
+
+
+def _read_lines(pipe, callback, sizes):
+    """
+    Deliver a pipe's decoded lines to a callback, including the line
+    terminator, split on both newlines and carriage-returns
+
+    :param sizes: List the total bytes read are appended to
+    """
+    pending = b''
+    size = 0
+    read = getattr(pipe, 'read1', pipe.read)
+    while True:
+        chunk = read(65536)
+        if not chunk:
+            break
+        size += len(chunk)
+        lines = (pending + chunk).splitlines(True)
+        pending = b''
+        if not lines[-1].endswith((b'\n', b'\r')):
+            pending = lines.pop()
+        for line in lines:
+            callback(_decode(line))
+    if pending:
+        callback(_decode(pending))
+    sizes.append(size)
+    pipe.close()
+
+
+def _encode(text):
+    return text.encode('utf_8') if text is not None else None
+
+
+def _decode(data):
+    return data.decode('utf_8', 'replace') if data else ''
+
+
+class Pool(object):
+    """
+    Bounded pool of worker threads running callables concurrently
+
+    Processes started with `run()` from a pool's workers are tracked, so
+    cancelling the pool (or interrupting it with ^C) kills them and drops
+    queued work.
+    """
+    _counter = itertools.count()
+
+    def __init__(self, jobs=DEFAULT_JOBS):
+        """
+        :param jobs: Maximum number of concurrent workers
+        """
+        self._jobs = max(1, int(jobs or DEFAULT_JOBS))
+        self._name = 'mx-pool-{}'.format(next(self._counter))
+        self._cancelled = threading.Event()
+        self._futures = []
+
+    def map(self, func, items, ordered=False):
+        """
+        Call func for each item concurrently
+
+        :param func: Callable receiving a single item
+        :param items: Iterable of items
+        :param ordered: Yield in items' order, rather than as completed
+        :return: Generator of (item, result) tuples, work dropped by
+                 `cancel()` isn't yielded
+        """
+        # Imported on demand, single command invocations don't need it
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        items = list(items)
+        executor = ThreadPoolExecutor(max_workers=self._jobs,
+                                      thread_name_prefix=self._name)
+        try:
+            futures = [executor.submit(self._call, func, item)
+                       for item in items]
+            self._futures.extend(futures)
+            index = dict((future, i) for i, future in enumerate(futures))
+            for future in futures if ordered else as_completed(futures):
+                if not future.cancelled():
+                    yield items[index[future]], future.result()
+        except BaseException:
+            self.cancel()
+            raise
+        finally:
+            executor.shutdown(wait=True)
+
+    def cancel(self):
+        """
+        Drop queued work and kill processes started by this pool's workers
+        """
+        self._cancelled.set()
+        for future in self._futures:
+            future.cancel()
+        with _running_lock:
+            processes = [process for process, thread in _running.items()
+                         if thread.startswith(self._name + '_')]
+        for process in processes:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def _call(self, func, item):
+        _local.cancelled = self._cancelled
+        try:
+            return func(item)
+        finally:
+            _local.cancelled = None
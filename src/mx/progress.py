@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from .logger import Logger
+
+
+class Progress(object):
+    """
+    Live progress display, one line per running task, kept at the bottom of
+    the terminal and redrawn in place with ANSI escape codes
+
+    Updates are thread-safe and throttled. Nothing is drawn when stdout isn't
+    a terminal.
+    """
+    _interval = 0.1
+
+    def __init__(self, enabled=None):
+        """
+        :param enabled: Draw progress (default: stdout is a terminal showing
+                        text output)
+        """
+        if enabled is None:
+            enabled = sys.stdout.isatty() and not Logger().structured
+        self.enabled = enabled
+        self._lines = OrderedDict()
+        self._drawn = 0
+        self._last_draw = 0
+        self._lock = threading.RLock()
+
+    def update(self, key, text):
+        """
+        Set a task's progress line
+
+        :param key: Task identifier
+        :param text: Progress description, without line breaks
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._lines[key] = text
+            if time.time() - self._last_draw >= self._interval:
+                self._redraw()
+
+    def done(self, key):
+        """
+        Remove a task's progress line
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._lines.pop(key, None) is not None:
+                self._redraw()
+
+    @contextmanager
+    def hidden(self):
+        """
+        Hide progress lines while printing other output
+        """
+        with self._lock:
+            self._clear()
+            try:
+                yield
+            finally:
+                self._draw()
+
+    def _redraw(self):
+        self._clear()
+        self._draw()
+
+    def _clear(self):
+        if self._drawn:
+            # Move to the first progress line and erase until the end
+            sys.stdout.write('\x1b[{}F\x1b[J'.format(self._drawn))
+            sys.stdout.flush()
+            self._drawn = 0
+
+    def _draw(self):
+        if not self.enabled or not self._lines:
+            return
+        # Lines must not wrap, or they can't be erased reliably
+        width = shutil.get_terminal_size().columns - 1
+        sys.stdout.write(''.join(
+            '{}\n'.format(line[:width]) for line in self._lines.values()))
+        sys.stdout.flush()
+        self._drawn = len(self._lines)
+        self._last_draw = time.time()
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+
+
+class RepositoryException(Exception):
+    """
+    Raised when a repository's layout can't be read in-process,
+    callers should fall back to running git itself
+    """
+    pass
+
+
+class Repository(object):
+    """
+    Read-only, in-process reader for a Git repository's metadata
+
+    Reads HEAD, loose refs, packed-refs and config straight from the
+    repository directory, without spawning git. Supports `.git` files
+    (`gitdir:` pointers) used by worktrees and submodules.
+    """
+    _max_symref_depth = 5
+
+    def __init__(self, path):
+        """
+        :param path: Repository work-tree root, containing `.git`
+        """
+        if os.environ.get('GIT_DIR') or os.environ.get('GIT_WORK_TREE'):
+            raise RepositoryException('GIT_DIR environment is not supported')
+
+        self.work_tree = path
+        self.git_dir = self.find_git_dir(path)
+        if not self.git_dir:
+            raise RepositoryException('Not a git repository: ' + path)
+
+        # Linked worktrees share refs and config with a common directory
+        self.common_dir = self.git_dir
+        commondir = self._read_file(os.path.join(self.git_dir, 'commondir'))
+        if commondir:
+            self.common_dir = os.path.normpath(
+                os.path.join(self.git_dir, commondir.strip()))
+
+        self._packed_refs = None
+        self._config = None
+        if self.config('extensions.refstorage', 'files') != 'files':
+            raise RepositoryException('Unsupported ref storage')
+
+    @classmethod
+    def discover(cls, path):
+        """
+        Find the repository containing path, searching parent directories
+
+        :param path: Any directory
+        :return: Repository instance, or None if path isn't within a
+                 repository
+        """
+        path = os.path.abspath(path)
+        while True:
+            if cls.find_git_dir(path):
+                return cls(path)
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+    @staticmethod
+    def find_git_dir(path):
+        """
+        Locate the git directory of a work-tree root, following `.git` files
+
+        :param path: Repository work-tree root
+        :return: Absolute git directory path or None
+        """
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            if os.path.isfile(os.path.join(dot_git, 'HEAD')):
+                return dot_git
+            return None
+
+        content = Repository._read_file(dot_git)
+        if content and content.startswith('gitdir:'):
+            git_dir = os.path.join(path, content[7:].strip())
+            if os.path.isfile(os.path.join(git_dir, 'HEAD')):
+                return os.path.normpath(git_dir)
+        return None
+
+    def head(self):
+        """
+        Read HEAD's current branch and commit
+
+        :return: (branch, sha) tuple, branch is None when detached and sha is
+                 None for unborn branches
+        """
+        content = self._read_file(os.path.join(self.git_dir, 'HEAD'))
+        if content is None:
+            raise RepositoryException('Unable to read HEAD')
+        content = content.strip()
+        if content.startswith('ref: '):
+            ref = content[5:]
+            branch = ref[11:] if ref.startswith('refs/heads/') else None
+            if branch is None:
+                raise RepositoryException('Unsupported HEAD: ' + ref)
+            return branch, self.resolve(ref)
+        return None, content
+
+    def resolve(self, ref):
+        """
+        Resolve a full reference name to a commit, following symbolic refs
+
+        :param ref: Full reference name, e.g. refs/remotes/origin/master
+        :return: Object name or None if reference doesn't exist
+        """
+        for _ in range(self._max_symref_depth):
+            content = self._read_file(os.path.join(self.common_dir, ref))
+            if content is None:
+                return self._read_packed_refs().get(ref)
+            content = content.strip()
+            if not content.startswith('ref: '):
+                return content
+            ref = content[5:]
+        raise RepositoryException('Symbolic reference is too deep')
+
+    def fingerprint(self):
+        """
+        Collect modification times and sizes of the index, HEAD,
+        packed-refs and branch/remote refs
+
+        The fingerprint changes whenever a commit, checkout, stage, fetch or
+        push happens, so it can validate previously computed information.
+
+        :return: List of [path, mtime_ns, size] entries
+        """
+        paths = [os.path.join(self.git_dir, 'index'),
+                 os.path.join(self.git_dir, 'HEAD'),
+                 os.path.join(self.common_dir, 'packed-refs')]
+        for refs in ('heads', 'remotes'):
+            for root, _, files in sorted(
+                    os.walk(os.path.join(self.common_dir, 'refs', refs))):
+                paths.extend(os.path.join(root, name)
+                             for name in sorted(files))
+
+        entries = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append([os.path.relpath(path, self.common_dir),
+                            stat.st_mtime_ns, stat.st_size])
+        return entries
+
+    def last_fetch(self):
+        """
+        Returns the time of the repository's last fetch, by anyone, from
+        FETCH_HEAD's modification time, or None if it was never fetched
+        """
+        times = []
+        for git_dir in set([self.git_dir, self.common_dir]):
+            try:
+                times.append(
+                    os.stat(os.path.join(git_dir, 'FETCH_HEAD')).st_mtime)
+            except OSError:
+                pass
+        return max(times) if times else None
+
+    def upstream(self, branch):
+        """
+        Resolve a branch's configured upstream
+
+        :param branch: Local branch name
+        :return: (short name, full reference) tuple, or (None, None) when the
+                 branch has no upstream
+        """
+        remote = self.config('branch.{}.remote'.format(branch))
+        merge = self.config('branch.{}.merge'.format(branch))
+        if not remote or not merge:
+            return None, None
+        if not merge.startswith('refs/heads/'):
+            raise RepositoryException('Unsupported merge ref: ' + merge)
+        name = merge[11:]
+        if remote == '.':
+            return name, merge
+
+        # Only the default fetch refspec is mapped in-process
+        refspec = self.config('remote.{}.fetch'.format(remote), '')
+        if refspec.lstrip('+') != \
+                'refs/heads/*:refs/remotes/{}/*'.format(remote):
+            raise RepositoryException('Unsupported refspec: ' + refspec)
+        return '{}/{}'.format(remote, name), \
+            'refs/remotes/{}/{}'.format(remote, name)
+
+    def remote_url(self, remote='origin'):
+        """
+        Returns a remote's configured URL, or None
+        """
+        return self.config('remote.{}.url'.format(remote))
+
+    def config(self, key, default=None):
+        """
+        Get a configuration value, last one wins like `git config --get`
+
+        :param key: Dotted key, e.g. remote.origin.url
+        :param default: Value returned if key isn't set
+        """
+        if self._config is None:
+            self._config = {}
+            self._parse_config(os.path.join(self.common_dir, 'config'))
+            if self._config.get('extensions.worktreeconfig', 'false') \
+                    .lower() in ('true', 'yes', 'on', '1'):
+                self._parse_config(
+                    os.path.join(self.git_dir, 'config.worktree'))
+
+        section, _, name = key.rpartition('.')
+        section, dot, subsection = section.partition('.')
+        key = ''.join([section.lower(), dot, subsection, '.', name.lower()])
+        return self._config.get(key, default)
+
+    def _parse_config(self, path):
+        """
+        Parse a git config file into the flat configuration dictionary
+        """
+        content = self._read_file(path)
+        if content is None:
+            return
+
+        section = ''
+        lines = iter(content.splitlines())
+        for line in lines:
+            line = line.strip()
+            if line.startswith('['):
+                match = re.match(
+                    r'\[\s*([\w.-]+)\s*(?:"((?:[^"\\]|\\.)*)")?\s*\](.*)$',
+                    line)
+                if not match:
+                    raise RepositoryException('Unable to parse ' + path)
+                name, subsection, line = match.groups()
+                name, dot, legacy = name.partition('.')
+                section = name.lower()
+                if section in ('include', 'includeif'):
+                    raise RepositoryException('Config includes unsupported')
+                if subsection is not None:
+                    section += '.' + re.sub(r'\\(.)', r'\1', subsection)
+                elif dot:
+                    section += '.' + legacy.lower()
+                line = line.strip()
+
+            if not line or line[0] in '#;':
+                continue
+
+            key, eq, value = line.partition('=')
+            key = key.strip().lower()
+            if not eq:
+                self._config['.'.join([section, key])] = 'true'
+                continue
+
+            # Join continuation lines ending with an unescaped backslash
+            value = value.lstrip()
+            while re.search(r'(?<!\\)(\\\\)*\\$', value):
+                value = value[:-1] + next(lines, '')
+            self._config['.'.join([section, key])] = \
+                self._parse_config_value(value)
+
+    @staticmethod
+    def _parse_config_value(value):
+        """
+        Unquote and unescape a raw config value, dropping trailing comments
+        """
+        escapes = {'n': '\n', 't': '\t', 'b': '\b', '"': '"', '\\': '\\'}
+        result = []
+        quoted = False
+        chars = iter(value)
+        for char in chars:
+            if char == '"':
+                quoted = not quoted
+            elif char == '\\':
+                result.append(escapes.get(next(chars, ''), ''))
+            elif char in '#;' and not quoted:
+                break
+            else:
+                result.append(char)
+        return ''.join(result).strip()
+
+    def _read_packed_refs(self):
+        """
+        Lazily parse packed-refs into a reference to object dictionary
+        """
+        if self._packed_refs is None:
+            self._packed_refs = {}
+            content = self._read_file(
+                os.path.join(self.common_dir, 'packed-refs'))
+            for line in (content or '').splitlines():
+                if line and line[0] not in '#^':
+                    sha, _, ref = line.partition(' ')
+                    self._packed_refs[ref] = sha
+        return self._packed_refs
+
+    @staticmethod
+    def _read_file(path):
+        """
+        Read a small text file, returns None if it doesn't exist
+        """
+        try:
+            with open(path, 'r') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
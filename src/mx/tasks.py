@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import glob
+import os
+import threading
+from . import process
+from .cache import TaskCache
+
+
+class TaskException(Exception):
+    def __init__(self, message, errors=''):
+        super(TaskException, self).__init__(message)
+        self.errors = errors
+        self.message = message
+
+
+class Task(object):
+    """
+    A workspace command, run before its session's windows are created
+    """
+
+    def __init__(self, name, run, after=None, inputs=None):
+        """
+        :param name: Unique name, referenced by other tasks' `after`
+        :param run: Shell command
+        :param after: Names of tasks that must succeed first
+        :param inputs: File paths or glob patterns, relative to the
+                       workspace root. Without inputs a task always runs.
+        """
+        self.name = name
+        self.run = run
+        self.after = after or []
+        self.inputs = inputs or []
+
+    def fingerprint(self, root):
+        """
+        Collect the command and its input files' modification times and
+        sizes, None if the task has no inputs
+
+        :param root: Workspace root directory
+        :return: List of entries
+        """
+        if not self.inputs:
+            return None
+        paths = set()
+        for pattern in self.inputs:
+            paths.update(glob.glob(os.path.join(root, pattern),
+                                   recursive=True))
+
+        entries = [self.run]
+        for path in sorted(paths):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append([os.path.relpath(path, root),
+                            stat.st_mtime_ns, stat.st_size])
+        return entries
+
+
+def load(commands):
+    """
+    Normalize `commands` configuration into tasks, in dependency order.
+    A command definition:
+      - string - shell command, runs after the preceding command
+      - dictionary - { run: '', name: '', after: '' / [], inputs: '' / [] }
+
+    :param commands: List of command definitions
+    :return: List of tasks, each after its dependencies
+    """
+    tasks = []
+    previous = None
+    for command in commands:
+        if isinstance(command, str):
+            task = Task(command, command, [previous] if previous else [])
+        else:
+            if not command.get('run'):
+                raise TaskException('Command without `run`', str(command))
+            after = command.get('after', [])
+            inputs = command.get('inputs', [])
+            task = Task(command.get('name') or command['run'], command['run'],
+                        [after] if isinstance(after, str) else after,
+                        [inputs] if isinstance(inputs, str) else inputs)
+        tasks.append(task)
+        previous = task.name
+
+    names = dict((task.name, task) for task in tasks)
+    if len(names) != len(tasks):
+        raise TaskException('Duplicate command names')
+    for task in tasks:
+        for name in task.after:
+            if name not in names:
+                raise TaskException('Unknown command dependency', name)
+
+    # Depth-first topological sort, keeping the configured order
+    ordered = []
+    state = {}
+
+    def visit(task):
+        if state.get(task.name) == 'done':
+            return
+        if state.get(task.name) == 'visiting':
+            raise TaskException('Command dependency cycle', task.name)
+        state[task.name] = 'visiting'
+        for name in task.after:
+            visit(names[name])
+        state[task.name] = 'done'
+        ordered.append(task)
+
+    for task in tasks:
+        visit(task)
+    return ordered
+
+
+def run_all(tasks, root, cache_name, jobs=None):
+    """
+    Run tasks concurrently, each once its dependencies succeeded
+
+    A task is skipped when its inputs are unchanged since its last
+    successful run, recorded in the cache pool, and none of its
+    dependencies with inputs ran. Tasks after a failed one are blocked,
+    others still run.
+
+    :param tasks: Tasks in dependency order, see `load()`
+    :param root: Working directory of commands
+    :param cache_name: Cache name, e.g. the workspace's name
+    :param jobs: Maximum concurrent commands
+    :return: List of (task, state, result) tuples in tasks' order, state is
+             one of ran, skipped, failed or blocked, result is the
+             process.Result of commands that ran
+    """
+    cache = TaskCache(cache_name)
+    done = dict((task.name, threading.Event()) for task in tasks)
+    states = {}
+    # Tasks whose inputs changed, their dependents must run too
+    changed = set()
+
+    def run(task):
+        # Tasks are queued in dependency order, so dependencies are
+        # already running or done and waiting can't starve the pool
+        for name in task.after:
+            done[name].wait()
+        try:
+            after = [states.get(name, 'failed') for name in task.after]
+            if any(state in ('failed', 'blocked') for state in after):
+                states[task.name] = 'blocked'
+                return None, None
+
+            fingerprint = task.fingerprint(root)
+            if fingerprint and changed.isdisjoint(task.after) and \
+                    cache.is_current(task.name, fingerprint):
+                states[task.name] = 'skipped'
+                return None, None
+
+            result = process.run(task.run, cwd=root, merge_stderr=True)
+            states[task.name] = 'ran' if result.ok else 'failed'
+            if fingerprint or not changed.isdisjoint(task.after):
+                changed.add(task.name)
+            return result, fingerprint
+        finally:
+            done[task.name].set()
+
+    results = {}
+    for task, (result, fingerprint) in process.Pool(jobs).map(run, tasks):
+        results[task.name] = result
+        if states.get(task.name) == 'ran':
+            cache.store(task.name, fingerprint)
+    cache.save()
+    return [(task, states.get(task.name, 'blocked'), results.get(task.name))
+            for task in tasks]
@@ -1,20 +1,43 @@
 # -*- coding: utf-8 -*-
-import json
 import os
-import subprocess
+import re
+from . import process
 from .logger import Logger
 
 log = Logger()
 
 
+_safe_arg = re.compile(r'^[\w@%+=:,./-]+$')
+
+
 class TmuxException(Exception):
     pass
 
 
+def quote(arg):
+    """
+    Quote an argument for tmux's command parser, as in hooks and
+    `source-file` scripts
+    """
+    if _safe_arg.match(arg):
+        return arg
+    return "'{}'".format(arg.replace("'", "'\"'\"'"))
+
+
 class Tmux(object):
     """
     Tmux controller
     """
+
+    def __init__(self, socket_name=None):
+        """
+        :param socket_name: Server socket name (`tmux -L`), default server
+                            if not specified
+        """
+        self._tmux = ['tmux']
+        if socket_name:
+            self._tmux.extend(['-L', socket_name])
+
     def command(self, cmd, formats=None, many=False):
         """
         Send custom Tmux command and return rich information
@@ -24,37 +47,78 @@ class Tmux(object):
         :param many:
         :return:
         """
-        cmd.insert(0, 'tmux')
+        cmd = list(cmd)
         if formats:
-            fmt = '{'
-            for key in formats:
-                fmt += ''.join(['"', key, '": ', '"#{', key, '}", '])
-            fmt = fmt[0:-2] + '}'
+            # Values are escaped by tmux (#{q:}) and separated by spaces
             cmd.append('-F')
-            cmd.append(fmt)
+            cmd.append(' '.join('#{q:' + key + '}' for key in formats))
 
         try:
-            process = subprocess.Popen(
-                cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            process.wait()
-            stdout = process.stdout.read()
-            process.stdout.close()
-            stderr = process.stderr.read()
-            process.stderr.close()
-            if stdout:
-                lines = ','.join(stdout.decode('utf_8').split('\n')) \
-                    .rstrip(',')
-                stdout = json.loads('[' + lines + ']' if many else lines)
-            if stderr:
-                stderr = stderr.decode('utf_8').strip()
-
-            return stdout, stderr
-        except ValueError:
-            raise TmuxException('Unable to serialize Tmux\'s response, '
-                                'please report bug.')
+            stdout, stderr = self._process_command(cmd)
         except Exception:
             raise TmuxException('Unable to execute Tmux, aborting.')
 
+        if formats:
+            rows = []
+            for line in stdout.splitlines():
+                values = self.split_format(line)
+                if len(values) != len(formats):
+                    raise TmuxException('Unable to parse Tmux\'s response, '
+                                        'please report bug.')
+                rows.append(dict(zip(formats, values)))
+            stdout = rows if many else (rows[0] if rows else {})
+
+        return stdout, stderr
+
+    @staticmethod
+    def split_format(line):
+        """
+        Split a line of space separated, backslash-escaped format values
+
+        :param line: A line formatted with `#{q:...}` values
+        :return: List of unescaped values
+        """
+        values = ['']
+        chars = iter(line)
+        for char in chars:
+            if char == '\\':
+                values[-1] += next(chars, '')
+            elif char == ' ':
+                values.append('')
+            else:
+                values[-1] += char
+        return values
+
+    def execute(self, commands):
+        """
+        Execute a plan of tmux commands, stopping at the first error
+
+        Commands are chained with `;` into a single tmux invocation.
+
+        :param commands: List of commands, each a list of arguments
+        :return: Error message, empty on success
+        """
+        args = []
+        for cmd in commands:
+            if args:
+                args.append(';')
+            # Arguments ending with a semicolon would separate commands
+            args.extend(arg[:-1] + '\\;' if arg.endswith(';') else arg
+                        for arg in cmd)
+        _, errors = self._process_command(args) if args else ('', '')
+        return errors
+
+    def _process_command(self, cmd):
+        """
+        Execute a command with a new tmux process
+
+        :return: (stdout, stderr) tuple
+        """
+        result = process.run(self._tmux + cmd)
+        if result.error:
+            raise TmuxException(result.error)
+        return result.stdout, result.stderr.strip()
+
     def within_session(self):
         """
         Returns true if current within a Tmux session
@@ -67,99 +131,8 @@ class Tmux(object):
 
         :param session_name: The session name to match
         """
-        try:
-            cmds = ['tmux', 'has-session', '-t', session_name]
-            # Compatibility code, python 2.x doesn't have subprocess.DEVNULL
-            with open(os.devnull, 'wb') as DEVNULL:
-                code = subprocess.check_call(cmds, stderr=DEVNULL)
-        except subprocess.CalledProcessError as e:
-            code = e.returncode
-        return code == 0
-
-    def new_session(self, session_name, win_name=''):
-        """
-        Create a new Tmux session
-
-        :param session_name: New session's name
-        :param win_name: The window's name within the new session
-        :return: (session, window, pane)
-        """
-        cmds = ['new-session', '-Pd', '-s', session_name]
-        if win_name:
-            cmds.extend(['-n', win_name])
-
-        output, errors = self.command(
-            cmds,
-            ['session_id', 'session_name', 'session_windows',
-             'window_id', 'window_index', 'pane_index', 'pane_id'])
-
-        if errors:
-            raise TmuxException(errors)
-        session = {}
-        window = {}
-        pane = {}
-        for k, v in output.items():
-            short_name = k.split('_')[1]
-            if k.startswith('window_'):
-                window[short_name] = v
-            elif k.startswith('pane_'):
-                pane[short_name] = v
-            else:
-                session[short_name] = v
-
-        return session, window, pane
-
-    def new_window(self, session_name, win_name=''):
-        """
-        Create a new Tmux window
-
-        :param session_name: Target session name
-        :param win_name: The new window's name
-        :return: (window, pane)
-        """
-        cmds = ['new-window', '-Pd', '-t', session_name]
-        if win_name:
-            cmds.extend(['-n', win_name])
-
-        output, errors = self.command(
-            cmds,
-            ['window_id', 'window_name', 'window_panes', 'window_active',
-             'window_index', 'window_layout', 'pane_index', 'pane_id'])
-
-        if errors:
-            raise Exception('Error creating window: {}'.format(errors))
-        window = {}
-        pane = {}
-        for k, v in output.items():
-            short_name = k.split('_')[1]
-            if k.startswith('pane_'):
-                pane[short_name] = v
-            else:
-                window[short_name] = v
-
-        return window, pane
-
-    def new_pane(self, session_name, window_id, pane_id):
-        """
-        Create a new Tmux pane
-
-        :param session_name: Target session name
-        :param window_id: Window to split from
-        :param pane_id: Pane to split from
-        :return: Pane information
-        """
-        output, errors = self.command(
-            ['split-window', '-h', '-P', '-t',
-             '{}:{}.{}'.format(session_name, window_id, str(pane_id))],
-            ['pane_id', 'pane_index', 'pane_active', 'pane_current_path',
-             'pane_start_command', 'pane_current_command', 'pane_title'])
-        if errors:
-            raise TmuxException(errors)
-        pane = {}
-        for k, v in output.items():
-            short_name = k.split('_')[1]
-            pane[short_name] = v
-        return pane
+        return process.run(
+            self._tmux + ['has-session', '-t', session_name]).ok
 
     def kill_session(self, session_name):
         """
@@ -167,37 +140,6 @@ class Tmux(object):
         """
         return self.command(['kill-session', '-t', session_name])
 
-    def set_layout(self, session_name, win_name, layout=None):
-        """
-        Sets a Tmux session's specific window to a different layout
-
-        :param session_name: Target session name
-        :param win_name: Target window name
-        :param layout: The layout name (even-horizontal, even-vertical,
-                                        main-horizontal, main-vertical, tiled)
-        """
-        return self.command([
-            'select-layout', '-t',
-            '{}:{}'.format(session_name, win_name), layout or 'tiled'
-        ])
-
-    def send_keys(self, session_name, win_name, pane_index, cmd, enter=True):
-        """
-        Sends a Tmux session custom keys
-
-        :param session_name: Target session name
-        :param win_name: Target window name
-        :param pane_index: Target pane index
-        :param cmd: The string to enter
-        :param enter: Finish with a carriage-return?
-        """
-        if cmd:
-            return self.command([
-                'send-keys', '-Rt',
-                '{}:{}.{}'.format(session_name, win_name, str(pane_index)),
-                cmd, 'C-m' if enter else ''
-            ])
-
     def attach(self, session_name):
         """
         Attach to an existing Tmux session
@@ -209,27 +151,30 @@ class Tmux(object):
                 else 'attach-session'
             return self.command([cmd, '-t', session_name])
 
-    def get_windows(self, session_name):
+    def list_session(self, session_name):
         """
-        Retrieve information for all windows in a session
+        Retrieve all windows and their panes of a session, in one query
 
         :param session_name: Target session name
-        """
-        return self.command(
-            ['list-windows', '-t', session_name],
-            ['window_id', 'window_name', 'window_panes', 'window_active',
-             'window_index', 'window_layout'],
+        :return: (windows, errors) tuple, windows is a list of window
+                 dictionaries, each with a `panes` list
+        """
+        rows, errors = self.command(
+            ['list-panes', '-s', '-t', '=' + session_name],
+            ['window_id', 'window_index', 'window_name', 'window_active',
+             'window_layout', 'pane_id', 'pane_index', 'pane_active',
+             'pane_current_command', 'pane_current_path',
+             'pane_start_command', 'pane_title'],
             many=True)
 
-    def get_panes(self, session_name, window_name):
-        """
-        Retrieve information for all panes in a window
-
-        :param session_name: Target session name
-        :param window_name: Target window name
-        """
-        return self.command(
-            ['list-panes', '-t', ':'.join([session_name, window_name])],
-            ['pane_id', 'pane_active', 'pane_index', 'pane_start_command',
-             'pane_current_command', 'pane_current_path', 'pane_title'],
-            many=True)
+        windows = []
+        for row in rows or []:
+            if not windows or windows[-1]['id'] != row['window_id']:
+                windows.append(dict(
+                    (k.split('_', 1)[1], v) for k, v in row.items()
+                    if k.startswith('window_')))
+                windows[-1]['panes'] = []
+            windows[-1]['panes'].append(dict(
+                (k.split('_', 1)[1], v) for k, v in row.items()
+                if k.startswith('pane_')))
+        return windows, errors
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import sys
+import threading
+
+# Recorded events, None while tracing is disabled
+_events = None
+_lock = threading.Lock()
+
+
+def enable():
+    """
+    Start recording subprocesses and tmux commands
+    """
+    global _events
+    _events = []
+
+
+def enabled():
+    return _events is not None
+
+
+def record(name, category, start, duration, **args):
+    """
+    Record a completed operation, safe to call from threads
+
+    :param name: Operation, e.g. the command line
+    :param category: Operation kind, e.g. git, tmux or shell
+    :param start: Start time, seconds since the epoch
+    :param duration: Wall-clock duration in seconds
+    :param args: Details, e.g. exit code, bytes of output and working
+                 directory
+    """
+    if _events is None:
+        return
+    thread = threading.current_thread()
+    with _lock:
+        _events.append({
+            'name': name, 'cat': category, 'ph': 'X',
+            'ts': int(start * 1e6), 'dur': int(duration * 1e6),
+            'pid': os.getpid(), 'tid': thread.ident,
+            'thread': thread.name, 'args': args})
+
+
+def command_name(args):
+    """
+    Returns a printable command line, and its category
+    """
+    if isinstance(args, list):
+        return ' '.join(args), os.path.basename(args[0]) if args else ''
+    return args, 'shell'
+
+
+def summary(top=10):
+    """
+    Returns lines describing the slowest recorded operations, commands are
+    prefixed with the name of the directory they ran in, e.g. `mx: git log`
+    """
+    events = sorted(_events or [], key=lambda e: e['dur'], reverse=True)
+    lines = ['{:>9} {:7} {:>6} {:>9}  {}'.format(
+        'ms', 'kind', 'exit', 'bytes', 'command')]
+    for event in events[:top]:
+        name = event['name']
+        cwd = event['args'].get('cwd')
+        if cwd:
+            name = '{}: {}'.format(
+                os.path.basename(os.path.normpath(cwd)) or cwd, name)
+        lines.append('{:9.1f} {:7} {:>6} {:>9}  {}'.format(
+            event['dur'] / 1e3, event['cat'][:7],
+            event['args'].get('returncode', ''),
+            event['args'].get('bytes', ''),
+            name if len(name) <= 80 else name[:77] + '...'))
+    return lines
+
+
+def save(path):
+    """
+    Write recorded operations as a Chrome trace-event file, viewable with
+    chrome://tracing or https://ui.perfetto.dev
+    """
+    events = []
+    threads = {}
+    for event in _events or []:
+        event = dict(event)
+        threads[event['tid']] = event.pop('thread')
+        events.append(event)
+    for tid, name in threads.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                       'tid': tid, 'args': {'name': name}})
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def finish(path, top=10):
+    """
+    Print the slowest operations to stderr and save the trace file
+    """
+    if _events is None:
+        return
+    total = sum(event['dur'] for event in _events) / 1e3
+    lines = [' :: Recorded {} operations, {:.1f}ms in total, slowest:'
+             .format(len(_events), total)]
+    lines.extend(summary(top))
+    lines.append(' :: Trace saved to {}'.format(path))
+    sys.stderr.write('\n'.join(lines) + '\n')
+    save(path)
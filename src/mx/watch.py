@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from .repository import Repository, RepositoryException
+
+# inotify(7) event flags
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+
+# Files of a git directory that affect a repository's status
+GIT_DIR_FILES = ('index', 'HEAD', 'packed-refs')
+
+
+class Inotify(object):
+    """
+    Minimal Linux inotify binding, through ctypes
+    """
+    _event = struct.Struct('iIII')
+    _mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+        IN_CREATE | IN_DELETE
+
+    def __init__(self):
+        """
+        :raises OSError: If inotify isn't available
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not supported')
+        self._libc = libc
+        self._fd = libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add(self, path):
+        """
+        Watch a directory's entries
+
+        :return: Watch descriptor, the same one for an already watched path
+        """
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(path), self._mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'Unable to watch ' + path)
+        return wd
+
+    def read(self, timeout=None):
+        """
+        Wait for events
+
+        :param timeout: Seconds to wait, None waits forever
+        :return: List of (watch descriptor, mask, name) tuples, empty if
+                 the timeout expired
+        """
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self._fd, 65536)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self._event.unpack_from(data, offset)
+            offset += self._event.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self._fd)
+
+
+class Watcher(object):
+    """
+    Waits for changes of repositories' index, HEAD and refs
+
+    Uses inotify when available, otherwise polls the repositories'
+    fingerprints. Neither spawns git.
+    """
+
+    def __init__(self, paths, interval=2.0):
+        """
+        :param paths: Repository work-tree paths
+        :param interval: Seconds between polls, without inotify
+        """
+        self._paths = list(paths)
+        self._interval = interval
+        self._watches = {}
+        self._fingerprints = {}
+        try:
+            self._inotify = Inotify()
+        except OSError:
+            self._inotify = None
+
+        for path in self._paths:
+            self._watch(path)
+
+    def wait(self, debounce=0.2, limit=1.0):
+        """
+        Block until repositories change, collecting bursts of events
+
+        :param debounce: Seconds of quiet that end a burst
+        :param limit: Maximum seconds to collect a burst
+        :return: Set of changed repository paths
+        """
+        changed = set()
+        while not changed:
+            changed = self._changes(None)
+        deadline = time.time() + limit
+        while time.time() < deadline:
+            more = self._changes(debounce)
+            if not more:
+                break
+            changed |= more
+
+        # New ref directories need watches, e.g. after a first fetch
+        for path in changed:
+            self._watch(path)
+        return changed
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+
+    def _changes(self, timeout):
+        """
+        Returns repositories that changed within timeout, or until the next
+        change if timeout is None
+        """
+        if self._inotify is None:
+            time.sleep(self._interval if timeout is None else timeout)
+            changed = set()
+            for path in self._paths:
+                fingerprint = self._fingerprint(path)
+                if fingerprint != self._fingerprints.get(path):
+                    self._fingerprints[path] = fingerprint
+                    changed.add(path)
+            return changed
+
+        changed = set()
+        for wd, mask, name in self._inotify.read(timeout):
+            if mask & IN_Q_OVERFLOW:
+                return set(self._paths)
+            if wd not in self._watches or name.endswith('.lock'):
+                continue
+            path, is_git_dir = self._watches[wd]
+            if not is_git_dir or name in GIT_DIR_FILES:
+                changed.add(path)
+        return changed
+
+    def _watch(self, path):
+        """
+        Watch a repository's git directories and ref directories, or record
+        its fingerprint for polling
+        """
+        if self._inotify is None:
+            self._fingerprints[path] = self._fingerprint(path)
+            return
+
+        try:
+            repo = Repository(path)
+        except RepositoryException:
+            return
+        dirs = [(repo.git_dir, True), (repo.common_dir, True),
+                (os.path.join(repo.common_dir, 'refs'), False)]
+        for refs in ('heads', 'remotes'):
+            for root, _, _ in os.walk(
+                    os.path.join(repo.common_dir, 'refs', refs)):
+                dirs.append((root, False))
+        for directory, is_git_dir in dirs:
+            try:
+                self._watches[self._inotify.add(directory)] = \
+                    (path, is_git_dir)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _fingerprint(path):
+        try:
+            return Repository(path).fingerprint()
+        except RepositoryException:
+            return None
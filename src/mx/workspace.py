@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
 import re
-import sys
 import os
-import subprocess
+import shlex
+from . import process, tasks
+from .cache import SummaryCache
 from .logger import Logger
-from .tmux import Tmux
-from .git import Git
+from .tmux import Tmux, TmuxException, quote
 
 log = Logger()
 
+# Session hook activating a lazy window, indexed by the window's position
+LAZY_HOOK = 'session-window-changed[{}]'
+LAZY_HOOK_BASE = 100
+
+# Pane commands that are interactive shells, not worth restoring
+SHELLS = ('bash', 'zsh', 'fish', 'sh', 'dash', 'ksh', 'mksh', 'tcsh', 'csh',
+          'nu', 'xonsh')
+
 
 class WorkspaceException(Exception):
     def __init__(self, message, errors=''):
@@ -18,25 +26,27 @@ class WorkspaceException(Exception):
 
 
 class Workspace(object):
-    _tmux = Tmux()
+    _tmux = None
     _config = {}
     _name = ''
     _root = ''
     _venv = []
-    _session = {}
-    _windows = []
 
-    def __init__(self, config=None):
+    def __init__(self, config=None, tmux=None):
         """
-        :param tmux: Tmux class instance
+        :param config: Dictionary with config schema
+        :param tmux: Tmux class instance (default: config's `tmux_socket`
+                     server)
         """
         self.set_config(config)
+        self._tmux = tmux or Tmux(self._config.get('tmux_socket'))
 
     def set_config(self, config):
         self._config = config
         self._name = self._config.get('name')
         self._root = self._config.get('dir') or os.getcwd()
         self._root = os.path.expanduser(self._root)
+        self._venv = []
 
         # Prepare a virtualenv source command, if any
         # The specified virtualenv path can be absolute or relative
@@ -49,63 +59,172 @@ class Workspace(object):
             self._venv = [
                 ' source "{}"'.format(os.path.join(venv, 'bin/activate'))]
 
-    def start(self):
+    def start(self, dry_run=False):
         """
         Create Tmux windows from `windows` configuration in YML
 
-        :return Collection of window information
+        The whole session is compiled into a plan of tmux commands and
+        executed with a single tmux invocation. If the session is already
+        running, only its missing windows and panes are created, and
+        layouts are reapplied. Running panes are left alone.
+
+        :param dry_run: Print the compiled plan instead of executing it
+        :return: The compiled plan, a list of tmux commands
         """
-        if self._root:
-            if not os.path.isdir(self._root):
-                raise WorkspaceException('Directory does not exist',
-                                         self._root)
-            os.chdir(self._root)
+        plan = self._create(dry_run)
+        if dry_run:
+            self._print_plan(plan)
+        else:
+            self.attach()
+        return plan
 
-        # Run commands before spawning windows
-        for cmd in self._config.get('commands', []):
-            retcode, stdout = subprocess.getstatusoutput(cmd)
-            if retcode != 0:
-                raise WorkspaceException(
-                    'Error {} while running `{}`'.format(retcode, cmd), stdout)
+    @classmethod
+    def start_all(cls, workspaces, jobs=None, dry_run=False):
+        """
+        Create multiple workspaces' sessions concurrently, each with its
+        own tmux client and commands, and attach to the first one started.
+        Failures are reported once detached.
 
-        for window in self._config.get('windows', []):
-            # Normalize window schema definition, a window definition:
-            #   - string - window name
-            #   - key/value - window name / command
-            #   - dictionary - { panes: [], layout: '', post_cmd: '' / [] }
-            if isinstance(window, str):
-                name = window
+        :param workspaces: List of Workspace instances
+        :param jobs: Maximum sessions created concurrently
+        :param dry_run: Print the compiled plans instead of executing them
+        """
+        failed = []
+        first = None
+        pool = process.Pool(jobs or len(workspaces))
+        for workspace, (plan, error) in pool.map(
+                lambda workspace: workspace._try_create(dry_run),
+                workspaces, ordered=True):
+            if error:
+                failed.append(workspace._name)
+                log.echo(' [red]::[reset] Failed starting [white]{}'
+                         .format(workspace._name),
+                         '   [red]::[reset] {}'.format(error))
+            elif dry_run:
+                log.echo(' [blue]::[reset] Session [boldyellow]{}[reset]:'
+                         .format(workspace._name))
+                workspace._print_plan(plan)
             else:
-                name = next(iter(window.keys()))
-                window = window[name] or {}
+                first = first or workspace
+                log.echo(' [blue]::[reset] Started [boldyellow]{}'
+                         .format(workspace._name))
 
-            if isinstance(window, str):
-                panes = [window]
-                window = {}
+        if first:
+            first.attach()
+        if failed:
+            raise WorkspaceException(
+                'Failed starting {} of {} sessions'.format(
+                    len(failed), len(workspaces)), ', '.join(failed))
+
+    @classmethod
+    def stop_all(cls, workspaces, jobs=None):
+        """
+        Kill multiple workspaces' sessions concurrently
+
+        :param workspaces: List of Workspace instances
+        :param jobs: Maximum sessions killed concurrently
+        """
+        failed = []
+        pool = process.Pool(jobs or len(workspaces))
+        for workspace, error in pool.map(
+                lambda workspace: workspace.stop(), workspaces,
+                ordered=True):
+            if error:
+                failed.append(workspace._name)
+                log.echo(' [red]::[reset] Failed stopping [white]{}'
+                         .format(workspace._name),
+                         '   [red]::[reset] {}'.format(error))
             else:
-                panes = window.get('panes', [])
+                log.echo(' [blue]::[reset] Stopped [boldyellow]{}'
+                         .format(workspace._name))
 
-            # Normalize post commands, can be string or list
-            post_cmds = window.get('post_cmd', [])
-            post_cmds = [post_cmds] if isinstance(post_cmds, str) \
-                else post_cmds
+        if failed:
+            raise WorkspaceException(
+                'Failed stopping {} of {} sessions'.format(
+                    len(failed), len(workspaces)), ', '.join(failed))
 
-            # Create session, window, and panes
-            # with a layout and post commands.
-            self._windows.append(
-                self.create_window(
-                    name, panes, post_cmds, window.get('layout')))
+    def _try_create(self, dry_run):
+        """
+        Create the session, safe to call from a thread
+
+        :return: (plan, error message) tuple
+        """
+        try:
+            return self._create(dry_run), None
+        except (WorkspaceException, TmuxException) as e:
+            return None, '\n'.join(filter(None, [
+                e.message, getattr(e, 'errors', '')]))
 
-        self.attach()
-        return self._windows
+    def _print_plan(self, plan):
+        for cmd in plan:
+            print(' '.join(quote(arg) for arg in cmd))
+
+    def _create(self, dry_run=False):
+        """
+        Run commands and create or reconcile the session, without
+        attaching
+
+        :param dry_run: Only compile the plan
+        :return: The compiled plan
+        """
+        plan = self.compile(self._live_windows())
+        if dry_run:
+            return plan
+
+        if not os.path.isdir(self._root):
+            raise WorkspaceException('Directory does not exist', self._root)
+
+        # Run commands before spawning windows
+        self._run_commands()
+
+        errors = self._tmux.execute(plan)
+        if errors:
+            raise WorkspaceException('Unable to create session', errors)
+        self._save_session_state(True)
+        return plan
+
+    def _run_commands(self):
+        """
+        Run `commands` concurrently in dependency order, skipping those
+        whose inputs didn't change since their last successful run
+        """
+        commands = self._config.get('commands', [])
+        if not commands:
+            return
+        try:
+            task_list = tasks.load(commands)
+        except tasks.TaskException as e:
+            raise WorkspaceException(e.message, e.errors)
+
+        for task, state, result in tasks.run_all(
+                task_list, self._root, self._name, self._config.get('jobs')):
+            if state == 'skipped':
+                log.echo(' [blue]::[reset] Skipped [white]{}'
+                         ' [boldblack](inputs unchanged)'.format(task.name))
+            elif state == 'failed':
+                raise WorkspaceException(
+                    'Error {} while running `{}`'.format(
+                        result.error or result.returncode, task.run),
+                    result.stdout.rstrip('\n'))
 
     def stop(self, name=None):
         """
         Kill a workspace session
 
         :param name: Session name
+        :return: Error message, empty on success
         """
-        self._tmux.kill_session(name or self._name)
+        _, errors = self._tmux.kill_session(name or self._name)
+        self._save_session_state(False, name)
+        return errors
+
+    def _save_session_state(self, is_on, name=None):
+        """
+        Update the session state in the workspace's `mx prompt` summary
+        """
+        summary = SummaryCache(name or self._name)
+        summary.set('session', is_on)
+        summary.save()
 
     def attach(self, name=None):
         """
@@ -119,79 +238,237 @@ class Workspace(object):
         """
         List windows and panes for a session
         """
-        windows, errors = self._tmux.get_windows(self._name)
+        windows, errors = self._tmux.list_session(self._name)
         if errors:
             raise WorkspaceException('Unable to list windows', errors)
-        log.echo(' [blue]::[reset] Windows:')
-        log.echo(repr(windows))
 
+        log.echo(' [blue]::[reset] Session [boldyellow]{}[reset]:'
+                 .format(self._name))
         for window in windows:
-            win_id = window['window_id']
-            panes, errors = self._tmux.get_panes(self._name, win_id)
-            if errors:
-                raise WorkspaceException('Unable to list panes', errors)
-            log.echo(' [blue]::[reset] Window "{}" panes:'.format(win_id))
-            log.echo(repr(panes))
+            if log.structured:
+                log.record('window', session=self._name, **window)
+                continue
+            label = '{}:{}{}'.format(window['index'], window['name'],
+                                     '*' if window['active'] == '1' else '')
+            for pane in window['panes']:
+                log.echo('   [white]{:>20} [boldblue]{:>3}{:1}'
+                         ' [boldblack]{:>5} [reset]{:12} {}'
+                         .format(label, pane['index'],
+                                 '*' if pane['active'] == '1' else '',
+                                 pane['id'], pane['current_command'],
+                                 pane['current_path']))
+                label = ''
 
-    def create_window(self, name, panes, post_cmds, layout=None):
+    def _live_windows(self):
         """
-        Create Tmux window and panes from configuration
+        List the running session's windows, in a single tmux query
 
-        :param name:
-        :param panes:
-        :param post_cmds:
-        :param layout:
-        :return
+        :return: Dictionary of window names and their number of panes, or
+                 None if the session isn't running
         """
-        if len(self._windows) > 0:
-            window, pane = self._tmux.new_window(self._name, name)
-        else:
-            self._session, window, pane = \
-                self._tmux.new_session(self._name, name)
-            if not self._session:
-                print('Error creating session buddy.')
-                sys.exit(1)
-
-        session_name = self._session['name']
-        window['panes'] = []
-        for pane_schema in panes:
-            if len(window['panes']) > 0:
-                pane = self._tmux.new_pane(session_name, name, pane['index'])
-            window['panes'].append(pane)
-
-            # Run commands+post-commands, and activate virtualenv
-            cmds = next(iter(pane_schema.values())) \
-                if isinstance(pane_schema, dict) else [pane_schema]
-            cmds = self._venv + cmds + post_cmds
-            for cmd in cmds:
-                self._tmux.send_keys(session_name, name, pane['index'], cmd)
-
-        self._tmux.set_layout(session_name, name, layout)
-        return window
+        windows, errors = self._tmux.list_session(self._name)
+        if errors:
+            if not self._tmux.has_session(self._name):
+                return None
+            raise WorkspaceException('Unable to list windows', errors)
+
+        live = {}
+        for window in windows:
+            live.setdefault(window['name'], len(window['panes']))
+        return live
+
+    def freeze(self):
+        """
+        Capture the running session's windows, exact layouts, and panes'
+        working directories and commands, from a single tmux query
+
+        :return: Dictionary with a `windows` list, in config schema
+        """
+        windows, errors = self._tmux.list_session(self._name)
+        if errors:
+            raise WorkspaceException('Unable to list windows', errors)
+
+        # tmux reports real paths, commands by their program name only
+        root = os.path.realpath(self._root)
+        schema = []
+        for window in windows:
+            panes = []
+            for pane in window['panes']:
+                cmds = []
+                path = pane['current_path']
+                if path and path != root:
+                    relative = os.path.relpath(path, root)
+                    if not relative.startswith(os.pardir):
+                        path = relative
+                    cmds.append('cd {}'.format(shlex.quote(path)))
+                if pane['current_command'] and \
+                        pane['current_command'] not in SHELLS:
+                    cmds.append(pane['current_command'])
+                panes.append(' && '.join(cmds))
+            schema.append({window['name']: {
+                'layout': window['layout'], 'panes': panes}})
+        return {'windows': schema}
+
+    def compile(self, live=None):
+        """
+        Compile `windows` configuration into a plan of tmux commands
+
+        Windows are addressed by their exact name, and panes through their
+        window's active pane, which is always the last one split. Thus the
+        plan doesn't depend on tmux's output and can be executed at once.
+
+        Commands of new `lazy` windows, except a new session's first one,
+        are deferred to a session hook that runs them once the window is
+        first selected.
+
+        :param live: Windows of the running session and their number of
+                     panes, only missing windows and panes are created
+        :return: List of tmux commands, each a list of arguments
+        """
+        plan = []
+        windows = self._windows_schema()
+        for position, (name, panes, post_cmds, layout, lazy) in \
+                enumerate(windows):
+            target = '={}:={}'.format(self._name, name)
+            existing = 0
+            if live is not None and name in live:
+                existing = live[name]
+                lazy = False
+            elif plan or live is not None:
+                plan.append(['new-window', '-d', '-t', '={}:'.format(
+                    self._name), '-n', name, '-c', self._root])
+            else:
+                plan.append(['new-session', '-d', '-s', self._name,
+                             '-n', name, '-c', self._root])
+                lazy = False
+
+            # Deferred commands address panes by index, counted from zero
+            # until the window is activated
+            deferred = []
+            if lazy:
+                plan.append(['set-option', '-w', '-t', target,
+                             'pane-base-index', '0'])
+
+            for index, pane_schema in enumerate(panes):
+                if index < existing:
+                    continue
+                if index > 0:
+                    plan.append(['split-window', '-h', '-t', target,
+                                 '-c', self._root])
+
+                # Run commands+post-commands, and activate virtualenv
+                cmds = next(iter(pane_schema.values())) \
+                    if isinstance(pane_schema, dict) else [pane_schema]
+                for cmd in self._venv + cmds + post_cmds:
+                    if not cmd:
+                        continue
+                    if lazy:
+                        deferred.append([
+                            'send-keys', '-R', '-t',
+                            '{}.{}'.format(target, index), cmd, 'C-m'])
+                    else:
+                        plan.append(['send-keys', '-R', '-t', target,
+                                     cmd, 'C-m'])
+
+            plan.append(['select-layout', '-t', target, layout or 'tiled'])
+            if lazy:
+                plan.append(self._lazy_hook(
+                    LAZY_HOOK_BASE + position, name, deferred))
+        return plan
+
+    def _lazy_hook(self, index, name, commands):
+        """
+        Compile a session hook running a window's deferred commands when
+        it's first selected, the hook then removes itself
+
+        :param index: Hook array index, unique in the session
+        :param name: Window name
+        :param commands: Deferred tmux commands
+        :return: set-hook command
+        """
+        session = '={}:'.format(self._name)
+        hook = LAZY_HOOK.format(index)
+        commands = [['set-hook', '-u', '-t', session, hook]] + commands + [
+            ['set-option', '-wu', '-t', '{}={}'.format(session, name),
+             'pane-base-index']]
+        script = ' ; '.join(' '.join(quote(arg) for arg in cmd)
+                            for cmd in commands)
+
+        # Escape format syntax in the window name
+        name = re.sub(r'([#,}])', r'#\1', name)
+        condition = '#{==:#{window_name},' + name + '}'
+        return ['set-hook', '-t', session, hook,
+                'if-shell -F {} {}'.format(quote(condition), quote(script))]
+
+    def _windows_schema(self):
+        """
+        Normalize `windows` configuration, a window definition:
+          - string - window name
+          - key/value - window name / command
+          - dictionary - { panes: [], layout: '', post_cmd: '' / [],
+                           lazy: false }
+
+        :return: Generator of (name, panes, post commands, layout, lazy)
+                 tuples
+        """
+        for window in self._config.get('windows', []):
+            if isinstance(window, str):
+                name = window
+            else:
+                name = next(iter(window.keys()))
+                window = window[name] or {}
+
+            if isinstance(window, str):
+                panes = [window]
+                window = {}
+            else:
+                panes = window.get('panes', [])
+
+            # Normalize post commands, can be string or list
+            post_cmds = window.get('post_cmd', [])
+            post_cmds = [post_cmds] if isinstance(post_cmds, str) \
+                else post_cmds
+
+            yield name, panes, post_cmds, window.get('layout'), \
+                bool(window.get('lazy'))
 
     @staticmethod
-    def initialize(root_dir):
+    def initialize(root_dir, depth=2, jobs=None):
         """
-        Initialize a new workspace .mx.yml file
+        Initialize a new workspace .mx.yml file, discovering repositories in
+        sub-directories
+
+        Directories are scanned in parallel, without spawning git, and
+        discovery doesn't descend into repositories.
+
+        :param root_dir: Workspace root directory
+        :param depth: Levels of sub-directories to search for repositories
+        :param jobs: Concurrent directory scans
+        :return: Workspace configuration dictionary
         """
-        dirs = next(os.walk(root_dir))[1]
+        entries = sorted(entry.name for entry in _scandir(root_dir)
+                         if entry.is_dir())
         repos = []
         skipped = []
-        for directory in dirs:
-            os.chdir(os.path.join(root_dir, directory))
-            if Git.is_git_repo():
+        pool = process.Pool(jobs)
+        for directory, found in pool.map(
+                lambda name: Workspace._discover(root_dir, name, depth - 1),
+                entries, ordered=True):
+            if not found:
+                skipped.append(directory)
+            for path, url in found:
+                if not url:
+                    skipped.append(path)
+                    continue
                 log.echo(' [blue]::[reset] Found directory'
-                         ' `[white]{}[reset]`'.format(directory))
-                url = Git.get_remote_url()
+                         ' `[white]{}[reset]`'.format(path))
                 name = url.replace(':', '/')
-                name = re.sub('.git$', '', name)
+                name = re.sub(r'\.git$', '', name.rstrip('/'))
                 name = '/'.join(name.split('/')[-2:])
-                if name.split('/')[1] == directory:
+                if name.split('/')[-1] == path:
                     repos.append(name)
                 else:
-                    repos.append({'dir': directory, 'name': name})
-            else:
-                skipped.append(directory)
+                    repos.append({'dir': path, 'name': name})
 
         log.echo(' [blue]::[yellow] Skipped[reset]'
                  ' non-git repositories: {}'.format(', '.join(skipped)))
@@ -201,3 +478,45 @@ class Workspace(object):
             'dir': root_dir,
             'repos': repos
         }
+
+    @staticmethod
+    def _discover(root_dir, path, depth):
+        """
+        Find repositories in a directory and its sub-directories, safe to
+        call from a thread
+
+        :param root_dir: Workspace root directory
+        :param path: Directory relative to root_dir
+        :param depth: Levels of sub-directories left to search
+        :return: Sorted list of (relative path, origin URL) tuples
+        """
+        from .git import Git
+        from .repository import Repository, RepositoryException
+
+        full_path = os.path.join(root_dir, path)
+        if Repository.find_git_dir(full_path):
+            try:
+                url = Repository(full_path).remote_url()
+            except RepositoryException:
+                url = Git.get_remote_url(full_path)
+            return [(path, url)]
+
+        found = []
+        if depth > 0:
+            # Don't follow symlinks or hidden directories, e.g. .cache
+            for entry in sorted(_scandir(full_path), key=lambda e: e.name):
+                if entry.is_dir(follow_symlinks=False) and \
+                        not entry.name.startswith('.'):
+                    found.extend(Workspace._discover(
+                        root_dir, os.path.join(path, entry.name), depth - 1))
+        return found
+
+
+def _scandir(path):
+    """
+    List a directory's entries, or none if it can't be read
+    """
+    try:
+        return list(os.scandir(path))
+    except OSError:
+        return []
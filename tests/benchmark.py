@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks mx against synthetic workspaces
+
+Generates local bare repositories with history as remotes, clones them into
+a workspace with dirty and untracked files, and times Git.status, Git.fetch,
+Git.clone and Workspace.start. Sessions are started on a private, headless
+tmux server (`tmux -L`), nothing touches the network, the user's tmux server
+or mx's cache.
+
+Results are written as JSON, tagged with the benchmarked commit, so runs are
+comparable across commits:
+
+    python tests/benchmark.py -o before.json
+    git checkout feature
+    python tests/benchmark.py --compare before.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GIT_ENV = {
+    'GIT_AUTHOR_NAME': 'mx', 'GIT_AUTHOR_EMAIL': 'mx@localhost',
+    'GIT_COMMITTER_NAME': 'mx', 'GIT_COMMITTER_EMAIL': 'mx@localhost',
+    'GIT_CONFIG_NOSYSTEM': '1', 'GIT_CONFIG_GLOBAL': os.devnull,
+}
+
+
+def git(args, cwd=None):
+    """
+    Run a git command quietly, returns its output
+    """
+    return subprocess.check_output(
+        ['git'] + args, cwd=cwd, stderr=subprocess.STDOUT,
+        universal_newlines=True)
+
+
+def commit(seed, count, files, tag):
+    """
+    Commit changes to a rotating set of files in the seed repository
+    """
+    for index in range(count):
+        path = os.path.join(seed, 'file{}.txt'.format(index % files))
+        with open(path, 'a') as f:
+            f.write('{} {}\n'.format(tag, index) * 20)
+        git(['add', '-A'], seed)
+        git(['commit', '-q', '-m', '{} {}'.format(tag, index)], seed)
+
+
+def make_remotes(base, args):
+    """
+    Create the seed repository with history and its bare clones, the
+    workspace's remotes
+
+    :return: (seed path, list of remote paths)
+    """
+    seed = os.path.join(base, 'seed')
+    git(['init', '-q', '-b', 'master', seed])
+    commit(seed, args.commits, args.files, 'history')
+
+    remotes = []
+    for index in range(args.repos):
+        remote = os.path.join(base, 'remotes', 'repo{}.git'.format(index))
+        git(['clone', '-q', '--bare', seed, remote])
+        remotes.append(remote)
+    return seed, remotes
+
+
+def make_workspace(base, remotes, args):
+    """
+    Clone remotes into a workspace, with dirty and untracked files
+
+    :return: Workspace configuration
+    """
+    root = os.path.join(base, 'workspace')
+    repos = []
+    for remote in remotes:
+        name = os.path.basename(remote)[:-4]
+        path = os.path.join(root, name)
+        git(['clone', '-q', remote, path])
+        for index in range(min(args.dirty, args.files)):
+            with open(os.path.join(path, 'file{}.txt'.format(index)),
+                      'a') as f:
+                f.write('dirty\n')
+        for index in range(args.untracked):
+            with open(os.path.join(path, 'new{}.txt'.format(index)),
+                      'w') as f:
+                f.write('untracked\n')
+        repos.append({'name': 'bench/' + name, 'url': remote})
+
+    windows = []
+    for index in range(args.windows):
+        windows.append({'win{}'.format(index): {
+            'panes': ['true'] * args.panes}})
+    return {'name': 'mx-bench', 'dir': root, 'repos': repos,
+            'windows': windows, 'jobs': args.jobs,
+            'tmux_socket': args.socket}
+
+
+def advance(seed, remotes, round_number):
+    """
+    Push a new commit to all remotes, so the next fetch has work to do
+    """
+    commit(seed, 1, 1, 'round{}'.format(round_number))
+    for remote in remotes:
+        git(['push', '-q', remote, 'master'], seed)
+
+
+def measure(func, repeat, setup=None):
+    """
+    Time a function, with its output discarded
+
+    :param func: Benchmarked function
+    :param repeat: Number of runs
+    :param setup: Function called before each run, not timed, with the run
+                  number
+    :return: Dictionary of run durations and their statistics, in seconds
+    """
+    runs = []
+    with open(os.devnull, 'w') as devnull:
+        for index in range(repeat):
+            if setup:
+                setup(index)
+            with contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                func()
+                runs.append(time.perf_counter() - start)
+    return {'runs': runs, 'min': min(runs), 'max': max(runs),
+            'median': statistics.median(runs),
+            'mean': statistics.mean(runs)}
+
+
+def version(args):
+    try:
+        return subprocess.check_output(
+            args, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def describe_commit():
+    """
+    Returns the benchmarked commit and whether the work-tree is modified
+    """
+    try:
+        sha = git(['rev-parse', 'HEAD'], ROOT).strip()
+        dirty = bool(git(['status', '--porcelain', '--untracked-files=no'],
+                         ROOT).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return sha, dirty
+
+
+def run(base, args):
+    """
+    Generate the synthetic workspace and run all benchmarks
+
+    :return: Dictionary of results per benchmark
+    """
+    # Benchmarked modules are imported once the environment is isolated
+    from mx.git import Git
+    from mx.tmux import Tmux
+    from mx.workspace import Workspace
+
+    class BenchWorkspace(Workspace):
+        def attach(self, name=None):
+            pass
+
+    seed, remotes = make_remotes(base, args)
+    config = make_workspace(base, remotes, args)
+    tmux = Tmux(args.socket)
+    results = {}
+
+    git_workspace = Git(config)
+    results['status'] = measure(
+        lambda: git_workspace.status(refresh=True), args.repeat)
+    results['status_cached'] = measure(
+        lambda: git_workspace.status(), args.repeat)
+    results['fetch'] = measure(
+        lambda: git_workspace.fetch(), args.repeat,
+        lambda index: advance(seed, remotes, index))
+
+    clone_config = dict(config, dir=os.path.join(base, 'clone'))
+
+    def reset_clone(index):
+        shutil.rmtree(clone_config['dir'], ignore_errors=True)
+    results['clone'] = measure(
+        lambda: Git(clone_config).clone(), args.repeat, reset_clone)
+
+    # An idle session keeps the server running, like a user's server, and
+    # avoids racing a server that's shutting down after kill-server
+    subprocess.check_call(
+        tmux._tmux + ['new-session', '-d', '-s', 'mx-bench-idle'])
+
+    def kill_session(index):
+        subprocess.call(tmux._tmux + ['kill-session', '-t', config['name']],
+                        stderr=subprocess.DEVNULL)
+    try:
+        results['start'] = measure(
+            lambda: BenchWorkspace(config, tmux).start(), args.repeat,
+            kill_session)
+    finally:
+        subprocess.call(tmux._tmux + ['kill-server'],
+                        stderr=subprocess.DEVNULL)
+    return results
+
+
+def compare(previous, current):
+    """
+    Print median durations of two runs side by side
+    """
+    print('{:16} {:>10} {:>10} {:>8}'.format(
+        'benchmark', 'before ms', 'after ms', 'ratio'))
+    for name, result in current['results'].items():
+        after = result['median'] * 1e3
+        before = previous['results'].get(name, {}).get('median')
+        if before is None:
+            print('{:16} {:>10} {:10.1f}'.format(name, '-', after))
+            continue
+        before *= 1e3
+        print('{:16} {:10.1f} {:10.1f} {:7.2f}x'.format(
+            name, before, after, after / before if before else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark mx against a synthetic workspace')
+    parser.add_argument('--repos', type=int, default=20,
+                        help='Number of repositories')
+    parser.add_argument('--commits', type=int, default=50,
+                        help='Commits of history per repository')
+    parser.add_argument('--files', type=int, default=20,
+                        help='Tracked files per repository')
+    parser.add_argument('--dirty', type=int, default=3,
+                        help='Modified files per repository')
+    parser.add_argument('--untracked', type=int, default=3,
+                        help='Untracked files per repository')
+    parser.add_argument('--windows', type=int, default=4,
+                        help='Session windows')
+    parser.add_argument('--panes', type=int, default=2,
+                        help='Panes per window')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Concurrent git jobs (default: mx default)')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Runs per benchmark')
+    parser.add_argument('-o', '--output',
+                        help='Write JSON results to file, instead of stdout')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='Compare with a previous run\'s results')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the generated workspace')
+    args = parser.parse_args()
+    args.socket = 'mx-bench-{}'.format(os.getpid())
+
+    base = tempfile.mkdtemp(prefix='mx-bench-')
+    # Isolate git, tmux and mx's cache from the user's environment
+    os.environ.update(GIT_ENV)
+    os.environ['XDG_CACHE_HOME'] = os.path.join(base, 'cache')
+    os.environ['TMUX_TMPDIR'] = base
+    os.environ.pop('TMUX', None)
+    sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+    try:
+        results = run(base, args)
+    finally:
+        if args.keep:
+            sys.stderr.write('Workspace kept at {}\n'.format(base))
+        else:
+            shutil.rmtree(base, ignore_errors=True)
+
+    sha, dirty = describe_commit()
+    report = {
+        'commit': sha,
+        'modified': dirty,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'git': version(['git', '--version']),
+        'tmux': version(['tmux', '-V']),
+        'params': {key: getattr(args, key) for key in (
+            'repos', 'commits', 'files', 'dirty', 'untracked', 'windows',
+            'panes', 'jobs', 'repeat')},
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    elif not args.compare:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
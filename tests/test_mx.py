@@ -1,3 +1,615 @@
+import json
+import os
+import time
+from mx import process, tasks, trace, watch
+from mx.cli import duration, load_config
+from mx.cache import StatusCache, SummaryCache
+from mx.git import FetchParser, Git, GitException, relative_time
+from mx.logger import Logger
+from mx.repository import Repository
+from mx.tmux import Tmux, quote
+from mx.workspace import Workspace, WorkspaceException
+
 
 def test_success():
     assert True
+
+
+def test_parse_git_fetch():
+    parser = FetchParser()
+    for line in ['From github.com:rafi/mx\n',
+                 ' * [new branch]      feature    -> origin/feature\n',
+                 '   bc23688..8be82ed  develop    -> origin/develop\n',
+                 ' * [new tag]         0.9.1      -> 0.9.1\n',
+                 ' x [deleted]         (none)     -> origin/foobar\n']:
+        parser.feed(line)
+    lines = Git._format_fetch(parser.refs)
+    assert len(lines) == 3
+    assert 'origin/feature' in lines[0] and '0.9.1' in lines[0]
+    assert 'origin/develop' in lines[1]
+    assert 'origin/foobar' in lines[2]
+
+    progress = []
+    parser = FetchParser(progress.append)
+    for line in ['remote: Counting objects: 100% (9/9), done.\n',
+                 'Receiving objects:  45% (9/20), 1.20 MiB | 2.00 MiB/s\r',
+                 ' * [new tag]         0.9.1      -> 0.9.1\n',
+                 'fatal: unable to access repository\n']:
+        parser.feed(line)
+    assert progress == ['Counting objects: 100% (9/9)',
+                        'Receiving objects: 45% (9/20), 1.20 MiB | 2.00 MiB/s']
+    assert parser.refs == [('*', 'new tag', '0.9.1', '0.9.1')]
+    assert parser.error() == 'fatal: unable to access repository'
+
+
+def test_clone_args():
+    git = Git({'clone': {'depth': 1, 'filter': 'blob:none'},
+               'repos': ['rafi/mx', {'name': 'vim/vim', 'depth': 0,
+                                     'single-branch': False}]})
+    assert git._clone_args(git._repos[0]) == ['--depth=1',
+                                              '--filter=blob:none']
+    assert git._clone_args(git._repos[1]) == ['--filter=blob:none',
+                                              '--no-single-branch']
+    assert git._repos[1]['dir'] == 'vim'
+
+
+def test_repos_without_owner():
+    git = Git({'repos': [{'name': 'mx', 'url': '/srv/git/mx.git'},
+                         {'name': 'vim', 'url': '/srv/git/vim.git'}]})
+    assert [repo['dir'] for repo in git._repos] == ['mx', 'vim']
+    row = {'error': None, 'modified': 1, 'untracked': 0, 'detached': False,
+           'ahead': 0, 'behind': 0, 'current': 'master'}
+    assert ' mx ' in git._format_status(git._repos[0], row)
+
+    for repos in (['mx'], [{'name': 'mx', 'dir': 'code'}]):
+        try:
+            Git({'repos': repos})
+            assert False, 'GitException expected'
+        except GitException as e:
+            assert e.errors == 'mx'
+
+
+def test_mirror_path(monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', '/cache')
+    mirror = '/cache/mx/mirrors/github.com/rafi/mx.git'
+    assert Git.mirror_path('https://github.com/rafi/mx.git') == mirror
+    assert Git.mirror_path('git@github.com:rafi/mx') == mirror
+    assert Git.mirror_path('ssh://git@github.com/rafi/mx.git/') == mirror
+    assert Git.mirror_path('/srv/../git/mx.git') == \
+        '/cache/mx/mirrors/srv/git/mx.git'
+
+
+def test_fetch_skips_mirrors(tmpdir, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir))
+    git = Git({'name': 'funyard', 'dir': str(tmpdir), 'mirrors': True,
+               'repos': ['rafi/mx', 'vim/vim']})
+    for repo in git._repos:
+        os.makedirs(git.mirror_path(repo['url']))
+    updated = []
+    monkeypatch.setattr(Git, '_update_mirror', lambda self, url, progress: (
+        updated.append(url)))
+    monkeypatch.setattr(Git, '_fetch_repo', lambda self, repo, progress: (
+        [], None))
+
+    # Recently fetched repositories are skipped, along with their mirrors
+    monkeypatch.setattr(Git, '_last_fetch', lambda self, repo: (
+        time.time() if repo['name'] == 'rafi/mx' else None))
+    git.fetch(stale=30)
+    assert updated == ['https://github.com/vim/vim.git']
+
+    # Nothing is started once the budget is spent
+    del updated[:]
+    clock = iter([0])
+    monkeypatch.setattr(time, 'time', lambda: next(clock, 100))
+    git.fetch(budget=1)
+    assert updated == []
+
+
+def test_parse_porcelain_status():
+    row = {'branch': None, 'upstream': None, 'detached': False,
+           'ahead': None, 'behind': None, 'modified': 0, 'untracked': 0}
+    for line in [
+            '# branch.oid 8be82ed2b36a7e0b1b8f7c0a4b1f0a2f3c4d5e6f',
+            '# branch.head develop',
+            '# branch.upstream origin/develop',
+            '# branch.ab +2 -5',
+            '1 .M N... 100644 100644 100644 abc abc setup.py',
+            '1 M. N... 100644 100644 100644 abc def README.md',
+            '? build/',
+            '? notes.txt']:
+        Git._parse_porcelain_line(line + '\n', row)
+    assert row['branch'] == 'develop'
+    assert row['upstream'] == 'origin/develop'
+    assert (row['ahead'], row['behind']) == (2, 5)
+    assert (row['modified'], row['untracked']) == (1, 2)
+
+
+def test_repository_reader(tmpdir):
+    git_dir = tmpdir.mkdir('repo').mkdir('.git')
+    git_dir.join('HEAD').write('ref: refs/heads/develop\n')
+    git_dir.join('packed-refs').write(
+        '# pack-refs with: peeled fully-peeled sorted\n'
+        '1111111111111111111111111111111111111111 refs/heads/develop\n'
+        '2222222222222222222222222222222222222222 refs/remotes/up/develop\n')
+    git_dir.join('config').write(
+        '[core]\n\tbare = false\n'
+        '[remote "up"]\n'
+        '\turl = "git@github.com:rafi/mx.git" ; comment\n'
+        '\tfetch = +refs/heads/*:refs/remotes/up/*\n'
+        '[branch "develop"]\n\tremote = up\n\tmerge = refs/heads/develop\n')
+    git_dir.mkdir('refs').mkdir('remotes').mkdir('up').join('develop') \
+        .write('3333333333333333333333333333333333333333\n')
+
+    repo = Repository(str(tmpdir.join('repo')))
+    assert repo.last_fetch() is None
+    git_dir.join('FETCH_HEAD').write('')
+    assert repo.last_fetch() == git_dir.join('FETCH_HEAD').mtime()
+    assert repo.head() == ('develop', '1' * 40)
+    assert repo.resolve('refs/remotes/up/develop') == '3' * 40
+    assert repo.upstream('develop') == ('up/develop',
+                                        'refs/remotes/up/develop')
+    assert repo.remote_url('up') == 'git@github.com:rafi/mx.git'
+    assert repo.config('core.bare') == 'false'
+
+    # Worktrees and submodules point to their git directory with a file
+    tmpdir.mkdir('linked').join('.git').write(
+        'gitdir: {}\n'.format(os.path.join('..', 'repo', '.git')))
+    assert Repository.discover(str(tmpdir.join('linked'))).git_dir == \
+        str(git_dir)
+
+
+def test_watcher(tmpdir, monkeypatch):
+    git_dir = tmpdir.mkdir('repo').mkdir('.git')
+    git_dir.join('HEAD').write('ref: refs/heads/master\n')
+    git_dir.mkdir('refs').mkdir('heads')
+    path = str(tmpdir.join('repo'))
+
+    watcher = watch.Watcher([path], interval=0.05)
+    git_dir.join('index').write('staged')
+    git_dir.join('index.lock').write('')
+    assert watcher.wait(debounce=0.05) == set([path])
+    watcher.close()
+
+    # Without inotify, repositories' fingerprints are polled
+    def unsupported():
+        raise OSError('inotify is not supported')
+    monkeypatch.setattr(watch, 'Inotify', unsupported)
+    watcher = watch.Watcher([path], interval=0.05)
+    git_dir.join('refs', 'heads', 'master').write('1' * 40)
+    assert watcher.wait(debounce=0.05) == set([path])
+
+
+def test_status_cache(tmpdir, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir))
+    cache = StatusCache('funyard')
+    cache.store('/srv/code/mx', [['HEAD', 1, 21]], {'branch': 'master'})
+    cache.save()
+
+    cache = StatusCache('funyard')
+    assert cache.lookup('/srv/code/mx', [['HEAD', 1, 21]]) == \
+        {'branch': 'master'}
+    assert cache.lookup('/srv/code/mx', [['HEAD', 2, 21]]) is None
+    assert cache.lookup('/srv/code/vim', [['HEAD', 1, 21]]) is None
+
+    # Work-tree changes don't alter the fingerprint, they're still counted
+    monkeypatch.setenv('GIT_CONFIG_NOSYSTEM', '1')
+    monkeypatch.setenv('GIT_CONFIG_GLOBAL', os.devnull)
+    path = tmpdir.join('code', 'mx')
+    for args in (['init', '-q', '-b', 'master', str(path)],
+                 ['-C', str(path), 'commit', '-q', '--allow-empty',
+                  '-m', 'init', '--author', 'mx <mx@localhost>']):
+        assert process.run(['git', '-c', 'user.name=mx',
+                            '-c', 'user.email=mx@localhost'] + args).ok
+    git = Git({'name': 'funyard', 'dir': str(tmpdir.join('code')),
+               'repos': [{'name': 'mx', 'url': str(path)}]})
+    repo = git._repos[0]
+    cache = StatusCache('funyard')
+    row = git._cached_status(repo, cache)
+    assert (row['branch'], row['modified'], row['untracked']) == \
+        ('master', 0, 0)
+    assert 'master' in row['current']
+    assert row['current'].endswith('seconds ago)\x1b[m')
+
+    path.join('notes.txt').write('draft')
+    row = git._cached_status(repo, cache)
+    assert (row['branch'], row['untracked']) == ('master', 1)
+    assert cache.lookup(str(path), Repository(str(path)).fingerprint())
+
+    # Structured records ask git for colorless output
+    try:
+        Logger.set_format('ndjson')
+        row = git._cached_status(repo, cache)
+    finally:
+        Logger.set_format(None)
+    assert row['current'].startswith('HEAD -> master (mx ')
+    assert '\x1b' not in row['current']
+
+
+def test_relative_time():
+    assert relative_time(1) == '1 second ago'
+    assert relative_time(5400) == '2 hours ago'
+    assert relative_time(86400 * 20) == '3 weeks ago'
+    assert relative_time(86400 * 400) == '1 year, 1 month ago'
+    assert relative_time(-10) == 'in the future'
+
+
+def test_tasks(tmpdir, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir.join('cache')))
+    tmpdir.join('requirements.txt').write('six\n')
+    task_list = tasks.load([
+        'echo setup',
+        {'name': 'deps', 'run': 'echo deps >> log',
+         'inputs': 'requirements.txt'},
+        {'name': 'gen', 'run': 'echo gen >> log', 'after': 'deps',
+         'inputs': ['*.proto']},
+        {'name': 'check', 'run': 'false', 'after': ['echo setup']},
+        {'name': 'lint', 'run': 'echo lint', 'after': 'check'}])
+    assert [task.name for task in task_list] == \
+        ['echo setup', 'deps', 'gen', 'check', 'lint']
+
+    def states():
+        return [state for _, state, _ in tasks.run_all(
+            task_list, str(tmpdir), 'funyard', jobs=4)]
+    assert states() == ['ran', 'ran', 'ran', 'failed', 'blocked']
+    assert states() == ['ran', 'skipped', 'skipped', 'failed', 'blocked']
+    tmpdir.join('requirements.txt').write('six\nattrs\n')
+    assert states() == ['ran', 'ran', 'ran', 'failed', 'blocked']
+    assert tmpdir.join('log').read() == 'deps\ngen\ndeps\ngen\n'
+
+    for commands in ([{'name': 'a', 'run': 'true', 'after': 'b'},
+                      {'name': 'b', 'run': 'true', 'after': 'a'}],
+                     [{'run': 'true', 'after': 'missing'}],
+                     [{'name': 'a'}]):
+        try:
+            tasks.load(commands)
+            assert False
+        except tasks.TaskException:
+            pass
+
+
+def test_summary_prompt(tmpdir, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir))
+    assert SummaryCache('funyard').render() == ''
+
+    git = Git({'name': 'funyard', 'dir': str(tmpdir), 'repos': []})
+    git._save_summary(True, [
+        {'modified': 2, 'untracked': 0, 'ahead': 1, 'behind': None},
+        {'modified': 0, 'untracked': 0, 'ahead': 2, 'behind': 5}])
+    assert SummaryCache('funyard').render() == \
+        u'funyard\u25cf 1* \u21913 \u21935'
+
+
+def test_load_config_snapshot(tmpdir, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir))
+    cfg = tmpdir.join('.mx.yml')
+    cfg.write('name: funyard\nwindows:\n  - dev: ls\n')
+    assert load_config(str(cfg)) == {'name': 'funyard',
+                                     'windows': [{'dev': 'ls'}]}
+    assert tmpdir.join('mx', 'configs').listdir()
+
+    # Any change to the file invalidates the snapshot
+    cfg.write('name: funyard\nwindows:\n  - dev: vim\n')
+    assert load_config(str(cfg))['windows'] == [{'dev': 'vim'}]
+
+
+def test_duration():
+    assert [duration(v) for v in ['30s', '5m', '1h', '90']] == \
+        [30, 300, 3600, 90]
+
+
+def test_logger_records(capsys):
+    log = Logger()
+    try:
+        Logger.set_format('json')
+        log.echo('[red]hidden')
+        log.record('status', repo='rafi/mx', current='\x1b[1;36mHEAD\x1b[m')
+        log.record('status', repo='vim/vim', current='')
+        log.close()
+        assert json.loads(capsys.readouterr().out) == [
+            {'type': 'status', 'repo': 'rafi/mx', 'current': 'HEAD'},
+            {'type': 'status', 'repo': 'vim/vim', 'current': ''}]
+
+        Logger.set_format('ndjson')
+        log.record('window', name='dev')
+        log.close()
+        assert capsys.readouterr().out == '{"name": "dev", "type": "window"}\n'
+    finally:
+        Logger.set_format(None)
+
+
+def test_tmux_quote():
+    assert quote('bench:w0.1') == 'bench:w0.1'
+    assert quote('') == "''"
+    assert quote('cd src; ls') == "'cd src; ls'"
+    assert quote("echo it's") == "'echo it'\"'\"'s'"
+
+
+def test_tmux_socket():
+    assert Tmux()._tmux == ['tmux']
+    assert Tmux('bench')._tmux == ['tmux', '-L', 'bench']
+    workspace = Workspace({'name': 'bench', 'tmux_socket': 'bench'})
+    assert workspace._tmux._tmux == ['tmux', '-L', 'bench']
+
+
+def test_compile_workspace():
+    plan = Workspace({
+        'name': 'funyard', 'dir': '/srv/code',
+        'windows': [
+            {'dev': 'ls'},
+            {'db': {'layout': 'even-horizontal',
+                    'post_cmd': 'clear',
+                    'panes': ['ipython', {'pgcli': ['pgcli -d fun']}]}}]
+    }).compile()
+    assert plan == [
+        ['new-session', '-d', '-s', 'funyard', '-n', 'dev', '-c', '/srv/code'],
+        ['send-keys', '-R', '-t', '=funyard:=dev', 'ls', 'C-m'],
+        ['select-layout', '-t', '=funyard:=dev', 'tiled'],
+        ['new-window', '-d', '-t', '=funyard:', '-n', 'db', '-c', '/srv/code'],
+        ['send-keys', '-R', '-t', '=funyard:=db', 'ipython', 'C-m'],
+        ['send-keys', '-R', '-t', '=funyard:=db', 'clear', 'C-m'],
+        ['split-window', '-h', '-t', '=funyard:=db', '-c', '/srv/code'],
+        ['send-keys', '-R', '-t', '=funyard:=db', 'pgcli -d fun', 'C-m'],
+        ['send-keys', '-R', '-t', '=funyard:=db', 'clear', 'C-m'],
+        ['select-layout', '-t', '=funyard:=db', 'even-horizontal'],
+    ]
+
+
+def test_compile_workspace_reconcile():
+    workspace = Workspace({
+        'name': 'funyard', 'dir': '/srv/code',
+        'windows': [{'dev': {'panes': ['ls', 'top']}}, {'db': 'pgcli'}]})
+    assert workspace.compile({'dev': 1, 'other': 2}) == [
+        ['split-window', '-h', '-t', '=funyard:=dev', '-c', '/srv/code'],
+        ['send-keys', '-R', '-t', '=funyard:=dev', 'top', 'C-m'],
+        ['select-layout', '-t', '=funyard:=dev', 'tiled'],
+        ['new-window', '-d', '-t', '=funyard:', '-n', 'db', '-c', '/srv/code'],
+        ['send-keys', '-R', '-t', '=funyard:=db', 'pgcli', 'C-m'],
+        ['select-layout', '-t', '=funyard:=db', 'tiled'],
+    ]
+    assert workspace.compile({'dev': 3, 'db': 1}) == [
+        ['select-layout', '-t', '=funyard:=dev', 'tiled'],
+        ['select-layout', '-t', '=funyard:=db', 'tiled'],
+    ]
+
+
+def test_compile_lazy_window():
+    plan = Workspace({
+        'name': 'funyard', 'dir': '/srv/code',
+        'windows': [{'dev': {'lazy': True, 'panes': ['ls']}},
+                    {'db': {'lazy': True, 'post_cmd': 'clear',
+                            'panes': ['ipython', 'pgcli']}}]
+    }).compile()
+    assert plan[:3] == [
+        ['new-session', '-d', '-s', 'funyard', '-n', 'dev', '-c', '/srv/code'],
+        ['send-keys', '-R', '-t', '=funyard:=dev', 'ls', 'C-m'],
+        ['select-layout', '-t', '=funyard:=dev', 'tiled'],
+    ]
+    assert plan[3:7] == [
+        ['new-window', '-d', '-t', '=funyard:', '-n', 'db', '-c', '/srv/code'],
+        ['set-option', '-w', '-t', '=funyard:=db', 'pane-base-index', '0'],
+        ['split-window', '-h', '-t', '=funyard:=db', '-c', '/srv/code'],
+        ['select-layout', '-t', '=funyard:=db', 'tiled'],
+    ]
+    hook = plan[7]
+    assert hook[:4] == ['set-hook', '-t', '=funyard:',
+                        'session-window-changed[101]']
+    assert hook[4].startswith("if-shell -F '#{==:#{window_name},db}' ")
+    assert len(plan) == 8
+    for command in ("send-keys -R -t =funyard:=db.0 ipython C-m",
+                    "send-keys -R -t =funyard:=db.1 clear C-m",
+                    "set-hook -u -t =funyard: "):
+        assert command in hook[4]
+
+
+def test_freeze_workspace(tmpdir):
+    root = str(tmpdir)
+
+    class FakeTmux(Tmux):
+        def list_session(self, session_name):
+            pane = {'current_path': root, 'current_command': 'zsh'}
+            return [
+                {'name': 'dev', 'layout': 'a1b2,80x24,0,0{40x24,0,0,1,'
+                                          '39x24,41,0,2}',
+                 'panes': [pane, dict(pane, current_path=root + '/src',
+                                      current_command='vim')]},
+                {'name': 'logs', 'layout': 'c3d4,80x24,0,0,3',
+                 'panes': [dict(pane, current_path='/var/log dir')]}], ''
+
+    workspace = Workspace({'name': 'funyard', 'dir': root}, FakeTmux())
+    frozen = workspace.freeze()
+    assert frozen == {'windows': [
+        {'dev': {'layout': 'a1b2,80x24,0,0{40x24,0,0,1,39x24,41,0,2}',
+                 'panes': ['', 'cd src && vim']}},
+        {'logs': {'layout': 'c3d4,80x24,0,0,3',
+                  'panes': ["cd '/var/log dir'"]}}]}
+
+    # Restoring applies the exact layouts
+    plan = Workspace(dict(frozen, name='funyard', dir=root)).compile()
+    assert ['select-layout', '-t', '=funyard:=dev',
+            'a1b2,80x24,0,0{40x24,0,0,1,39x24,41,0,2}'] in plan
+    assert ['send-keys', '-R', '-t', '=funyard:=dev', 'cd src && vim',
+            'C-m'] in plan
+
+
+def test_tmux_split_format():
+    assert Tmux.split_format(r'@1 w\ \"q\"\ \\x  %3') == \
+        ['@1', 'w "q" \\x', '', '%3']
+
+
+def test_process_run():
+    result = process.run('echo out; echo err >&2; exit 3')
+    assert (result.returncode, result.stdout, result.stderr) == \
+        (3, 'out\n', 'err\n')
+    assert not result.ok and result.error is None
+
+    lines = []
+    result = process.run(['printf', 'a\\rb\\nc'], on_stdout=lines.append)
+    assert result.ok and lines == ['a\r', 'b\n', 'c']
+
+    result = process.run(['sleep', '5'], timeout=0.1)
+    assert result.returncode is None and result.error.startswith('timed')
+
+    assert process.run(['/nonexistent/mx']).error
+
+
+def test_process_pool():
+    items = [3, 1, 2]
+    assert list(process.Pool(2).map(lambda i: i * 2, items, ordered=True)) \
+        == [(3, 6), (1, 2), (2, 4)]
+
+
+def test_initialize_discovery(tmpdir):
+    for path, url in [('mx', 'git@github.com:rafi/mx.git'),
+                      ('vim/editor', 'https://github.com/vim/vim.git'),
+                      ('vim/editor/nested', 'https://github.com/x/y.git')]:
+        git_dir = tmpdir.join(path).ensure(dir=True).mkdir('.git')
+        git_dir.join('HEAD').write('ref: refs/heads/master\n')
+        git_dir.join('config').write('[remote "origin"]\n\turl = ' + url)
+    tmpdir.mkdir('docs')
+    tmpdir.join('deep', 'er', 'repo', '.git', 'HEAD').ensure()
+
+    schema = Workspace.initialize(str(tmpdir), depth=2)
+    assert schema['repos'] == ['rafi/mx',
+                               {'dir': 'vim/editor', 'name': 'vim/vim'}]
+
+
+def test_trace(tmpdir, monkeypatch):
+    monkeypatch.setattr(trace, '_events', [])
+    process.run(['echo', 'traced'], cwd=str(tmpdir.mkdir('mx')))
+    process.run('exit 2')
+
+    assert len(trace.summary(top=1)) == 2
+    assert sorted(line.split()[1:] for line in trace.summary()[1:]) == \
+        [['echo', '0', '7', 'mx:', 'echo', 'traced'],
+         ['shell', '2', '0', 'exit', '2']]
+    trace.save(str(tmpdir.join('trace.json')))
+    events = json.load(tmpdir.join('trace.json').open())['traceEvents']
+    assert [(e['name'], e['cat'], e['args']['returncode'], e['args']['cwd'])
+            for e in events if e['ph'] == 'X'] == \
+        [('echo traced', 'echo', 0, str(tmpdir.join('mx'))),
+         ('exit 2', 'shell', 2, None)]
+    assert events[-1]['args'] == {'name': 'MainThread'}
+
+
+def test_workspaces_share_repos(tmpdir):
+    one = Git({'name': 'one', 'dir': str(tmpdir), 'repos': ['rafi/mx']})
+    two = Git({'name': 'two', 'dir': str(tmpdir) + '/',
+               'repos': ['rafi/mx', {'name': 'vim/vim', 'dir': 'editor'}]})
+    assert len(one._repos) == 1 and len(two._repos) == 2
+
+    tasks = Git._unique_repos([one, two])
+    assert list(tasks) == [str(tmpdir.join('mx')), str(tmpdir.join('editor'))]
+    assert tasks[str(tmpdir.join('mx'))][0] is one
+
+
+def test_fetch_all(tmpdir, monkeypatch, capsys):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir.join('cache')))
+    monkeypatch.setenv('GIT_CONFIG_NOSYSTEM', '1')
+    monkeypatch.setenv('GIT_CONFIG_GLOBAL', os.devnull)
+
+    def git(*args):
+        result = process.run(['git', '-c', 'user.name=mx',
+                              '-c', 'user.email=mx@localhost'] + list(args))
+        assert result.ok, result.stderr
+
+    seed = str(tmpdir.join('seed'))
+    git('init', '-q', '-b', 'master', seed)
+    git('-C', seed, 'commit', '-q', '--allow-empty', '-m', 'init')
+    code = tmpdir.join('code')
+    for name in ('mx', 'vim'):
+        remote = str(tmpdir.join('remotes', name + '.git'))
+        git('clone', '-q', '--bare', seed, remote)
+        git('clone', '-q', remote, str(code.join(name)))
+
+    # New commits and a tag for mx, vim's remote disappears
+    git('-C', seed, 'commit', '-q', '--allow-empty', '-m', 'next')
+    git('-C', seed, 'tag', 'v1.0')
+    git('-C', seed, 'push', '-q', '--tags',
+        str(tmpdir.join('remotes', 'mx.git')), 'master')
+    tmpdir.join('remotes', 'vim.git').remove()
+
+    repos = [{'name': name, 'url': str(tmpdir.join('remotes', name + '.git'))}
+             for name in ('mx', 'vim')]
+    one = Git({'name': 'one', 'dir': str(code), 'repos': repos})
+    two = Git({'name': 'two', 'dir': str(code), 'repos': repos[:1]})
+    fetched = []
+    fetch_repo = Git._fetch_repo
+    monkeypatch.setattr(Git, '_fetch_repo', lambda self, repo, progress: (
+        fetched.append(repo['name']) or fetch_repo(self, repo, progress)))
+
+    try:
+        Git.fetch_all([one, two], jobs=2)
+        assert False, 'GitException expected'
+    except GitException as e:
+        assert e.message == 'Failed fetching 1 of 2 repositories'
+        assert e.errors == 'vim'
+    assert sorted(fetched) == ['mx', 'vim']
+
+    lines = [line.strip() for line in capsys.readouterr().out.splitlines()]
+    sections = [index for index, line in enumerate(lines)
+                if line.startswith(':: Fetching git index')]
+    assert len(sections) == 2
+    assert 'project one' in lines[sections[0]]
+    assert 'project two' in lines[sections[1]]
+    first, second = lines[sections[0]:sections[1]], lines[sections[1]:]
+    assert any(line.startswith(':: Fetched mx') for line in first)
+    assert any(line.startswith(':: Failed fetching vim') for line in first)
+    assert any(line.startswith(':: Created tags: (v1.0)') for line in first)
+    assert any(line.startswith(':: Updated') and 'origin/master' in line
+               for line in first)
+    assert [line.split()[2] for line in second
+            if line.startswith(':: Fetched')] == ['mx']
+    assert SummaryCache('one').get('fetch_failed') == 1
+    assert SummaryCache('two').get('fetch_failed') == 0
+
+
+def test_start_all(tmpdir, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir))
+    calls = []
+
+    class FakeTmux(Tmux):
+        def list_session(self, session_name):
+            return [], 'no session'
+
+        def has_session(self, session_name):
+            return False
+
+        def execute(self, commands):
+            calls.append(commands[0][:5])
+            return 'duplicate session' if 'broken' in commands[0] else ''
+
+        def attach(self, session_name):
+            calls.append(['attach', session_name])
+
+        def kill_session(self, session_name):
+            calls.append(['kill-session', session_name])
+            return '', 'no session' if session_name == 'broken' else ''
+
+    workspaces = [Workspace({'name': name, 'dir': str(tmpdir),
+                             'windows': ['dev']}, FakeTmux())
+                  for name in ('one', 'two')]
+    Workspace.start_all(workspaces)
+    assert sorted(calls[:2]) == [['new-session', '-d', '-s', 'one', '-n'],
+                                 ['new-session', '-d', '-s', 'two', '-n']]
+    assert calls[2:] == [['attach', 'one']]
+    assert SummaryCache('two').get('session') is True
+
+    del calls[:]
+    workspaces.insert(0, Workspace({'name': 'broken', 'dir': str(tmpdir),
+                                    'windows': ['dev']}, FakeTmux()))
+    try:
+        Workspace.start_all(workspaces)
+        assert False
+    except WorkspaceException as e:
+        assert e.errors == 'broken'
+    # Sessions that started are still attached to
+    assert calls[3:] == [['attach', 'one']]
+
+    del calls[:]
+    try:
+        Workspace.stop_all(workspaces)
+        assert False
+    except WorkspaceException as e:
+        assert e.message == 'Failed stopping 1 of 3 sessions'
+        assert e.errors == 'broken'
+    assert len(calls) == 3